@@ -19,7 +19,7 @@ AVOIDANCE_DELAY = 5
 # BOIDS
 # ======================================================
 class Boid(object):
-    def __init__(self, flock_props, scene_objects, count, projection_points):
+    def __init__(self, flock_props, scene_objects, count, projection_points, obstacle_bounds=None):
         self.flock_props = flock_props
         
         self.position = mathutils.Vector((
@@ -36,13 +36,17 @@ class Boid(object):
         self.max_acceleration = flock_props.max_acceleration
         self.max_velocity = flock_props.max_velocity
         
+        self.index = count
+        self.perception_radius_sq = flock_props.perception_radius ** 2
+        self.perception_cos = math.cos(math.radians(flock_props.perception_angle))
         self.group = random.randint(0, flock_props.num_groups - 1)
-        self.mat = bpy.data.materials.new(f"boid{count}_mat")
-        self.mat.diffuse_color = BOID_MATERIALS[self.group]
+        self.mat = utils.get_material(f"boid{count}_mat", BOID_MATERIALS[self.group])
         self.color = BOID_MATERIALS[self.group]
 
-        self.object = utils.generate_boid_cone(self.mat, self.position, self.velocity)
+        self.object = utils.generate_boid_cone(self.mat, self.position, self.velocity, f"boid_{count}")
         self.scene_objects = scene_objects
+        # the flock passes the bounds it works out once for all its boids
+        self.obstacle_bounds = utils.obstacle_bounds(scene_objects) if obstacle_bounds is None else obstacle_bounds
         
         self.projection_points = projection_points
         
@@ -65,74 +69,66 @@ class Boid(object):
         elif self.position.z <= -self.flock_props.z_range:
             self.position.z = self.flock_props.z_range
     
-    def get_boids_in_perception(self, boids):
-        perceived_boids = []
-        for boid in boids:
-            if boid is not self:
-                if self.is_in_perception(boid):
-                    perceived_boids.append(boid)
-        return perceived_boids
-    
-    def is_in_perception(self, boid):
-        within_perception_radius = utils.dist(self.position, boid.position) < self.flock_props.perception_radius
-        
-        boid_difference_angle = utils.angle_between_vectors(self.velocity, boid.position - self.position)
-        
-        within_perception_angle = math.degrees(boid_difference_angle) < self.flock_props.perception_angle
-        within_group = self.group == boid.group
-        return within_perception_radius and within_perception_angle and within_group
-        
-    def align(self, boids):
-        steering = mathutils.Vector((0, 0, 0))
+    def perceive(self, boids, grid=None):
+        """ One pass over the other boids, summing the velocity, position and separation
+            (unit vector away from the other boid) of every boid in perception.
+            Cheap tests reject first: group, then squared distance, then the perception
+            cone as a dot product against its precomputed cosine
+        """
+        # with a spatial grid only the boids in the surrounding cells can be in perception
+        if grid is not None:
+            boids = grid.neighbors(self.position)
         total = 0
+        velocity_sum = mathutils.Vector((0, 0, 0))
+        position_sum = mathutils.Vector((0, 0, 0))
+        separation_sum = mathutils.Vector((0, 0, 0))
+        speed_sq = self.velocity.dot(self.velocity)
         for other in boids:
-            steering = steering + other.velocity
+            if other.group != self.group or other is self:
+                continue
+            diff = other.position - self.position
+            dist_sq = diff.dot(diff)
+            if dist_sq >= self.perception_radius_sq:
+                continue
+            if not utils.within_angle(self.velocity.dot(diff), speed_sq, dist_sq, self.perception_cos):
+                continue
+            velocity_sum += other.velocity
+            position_sum += other.position
+            separation_sum -= diff * (1 / math.sqrt(dist_sq))
             total += 1
-        if total > 0:
-            steering *= 1 / total
-            steering = utils.set_mag(steering, self.max_velocity) 
-            steering -= self.velocity
-            steering = utils.limit(steering, self.max_acceleration)
-        return steering
+        return total, velocity_sum, position_sum, separation_sum
     
-    def cohesion(self, boids):
-        steering = mathutils.Vector((0, 0, 0))
-        total = 0
-        for other in boids:
-            steering = steering + other.position
-            total += 1
-        if total > 0:
-            steering *= 1 / total
-            steering -= self.position
-            steering = utils.set_mag(steering, self.max_velocity)
-            steering -= self.velocity
-            steering = utils.limit(steering, self.max_acceleration)
-        return steering
-            
-    def separation(self, boids):
-        steering = mathutils.Vector((0, 0, 0))
-        total = 0
-        for other in boids:
-            d = utils.dist(self.position, other.position)
-            diff = self.position - other.position
-            diff *= 1 / d
-            steering += diff
-            total += 1
-        if total > 0:
-            steering *= 1 / total
-            steering = utils.set_mag(steering, self.max_velocity)
-            steering -= self.velocity
-            steering = utils.limit(steering, self.max_acceleration)
+    def steer(self, vector_sum, total, offset=None):
+        """ Steering towards the average of a sum over perceived boids, less offset """
+        if total == 0:
+            return mathutils.Vector((0, 0, 0))
+        steering = vector_sum * (1 / total)
+        if offset is not None:
+            steering -= offset
+        steering = utils.set_mag(steering, self.max_velocity)
+        steering -= self.velocity
+        steering = utils.limit(steering, self.max_acceleration)
         return steering
     
     def avoidance(self, boids, objects):
-        steering = mathutils.Vector((0, 0, 0))
-        obj = self.object
+        obstacle = self.find_obstacle()
+        if obstacle:
+            self.avoidance_delay = AVOIDANCE_DELAY
+#            self.mat.diffuse_color = (0, 0, 1, 1)
+            return self.steer_around(obstacle)
+#        else:
+#            self.mat.diffuse_color = self.color
+        return mathutils.Vector((0, 0, 0))
+    
+    def find_obstacle(self):
+        """ Closest scene object ahead of the boid within perception, or None """
         min_dist = 100000000
         min_dist_obj = None
-        for obj in self.scene_objects:
-            mwi = obj.matrix_world.inverted()
+        for obj, (mwi, center, radius) in zip(self.scene_objects, self.obstacle_bounds):
             ray_begin = mwi @ self.position
+            # the ray ends perception_radius away in obj's space, short of a mesh whose sphere is farther
+            if (ray_begin - center).length > radius + self.flock_props.perception_radius:
+                continue
             ray_end = mwi @ self.position + self.velocity
             ray_direction = (ray_end-ray_begin).normalized()
             result = obj.ray_cast(origin=ray_begin,direction=ray_direction, distance=self.flock_props.perception_radius)
@@ -141,28 +137,28 @@ class Boid(object):
                 if utils.dist(self.object.location, result[2]) < min_dist:
                     min_dist = utils.dist(self.object.location, result[2])
                     min_dist_obj = obj
-        if min_dist_obj:
-            self.avoidance_delay = AVOIDANCE_DELAY
-#            self.mat.diffuse_color = (0, 0, 1, 1)
-            for point in self.projection_points:
-                point.parent = self.object
-                point_location = point.matrix_world.to_translation() - self.object.location
-                point.parent = None
-                mwi = min_dist_obj.matrix_world.inverted()
-                ray_begin = mwi @ self.position
-                ray_end = mwi @ self.position + point_location
-                ray_direction = (ray_end-ray_begin).normalized()
-                result = min_dist_obj.ray_cast(origin=ray_begin,direction=ray_direction, distance=self.flock_props.perception_radius)
+        return min_dist_obj
+    
+    def steer_around(self, obstacle):
+        """ Steering towards the first projection point with a clear path past obstacle """
+        steering = mathutils.Vector((0, 0, 0))
+        for point in self.projection_points:
+            point.parent = self.object
+            point_location = point.matrix_world.to_translation() - self.object.location
+            point.parent = None
+            mwi = obstacle.matrix_world.inverted()
+            ray_begin = mwi @ self.position
+            ray_end = mwi @ self.position + point_location
+            ray_direction = (ray_end-ray_begin).normalized()
+            result = obstacle.ray_cast(origin=ray_begin,direction=ray_direction, distance=self.flock_props.perception_radius)
 
-                        
-                if not result[0]:
-                    steering = point_location
-                    steering = utils.set_mag(steering, self.max_velocity)
-                    steering -= self.velocity
-                    steering = utils.limit(steering, self.max_acceleration)
-                    return steering
-#        else:
-#            self.mat.diffuse_color = self.color
+                    
+            if not result[0]:
+                steering = point_location
+                steering = utils.set_mag(steering, self.max_velocity)
+                steering -= self.velocity
+                steering = utils.limit(steering, self.max_acceleration)
+                return steering
                 
         return steering
     
@@ -172,12 +168,12 @@ class Boid(object):
             
         
 
-    def flock(self, boids):
-        perceived_boids = self.get_boids_in_perception(boids)
-        alignment = self.align(perceived_boids)
-        cohesion = self.cohesion(perceived_boids)
-        separation = self.separation(perceived_boids)
-        avoidance = self.avoidance(perceived_boids, self.scene_objects)
+    def flock(self, boids, grid=None):
+        total, velocity_sum, position_sum, separation_sum = self.perceive(boids, grid)
+        alignment = self.steer(velocity_sum, total)
+        cohesion = self.steer(position_sum, total, self.position)
+        separation = self.steer(separation_sum, total)
+        avoidance = self.avoidance(boids, self.scene_objects)
         
         alignment *= self.flock_props.alignment_strength
         cohesion *= self.flock_props.cohesion_strength
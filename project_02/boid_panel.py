@@ -26,5 +26,10 @@ class FlockPanel(bpy.types.Panel):
         col.prop(flock_props, 'max_acceleration')
         col.prop(flock_props, 'frames')
         col.prop(flock_props, 'num_groups')
+        col.prop(flock_props, 'vectorized')
+        col.prop(flock_props, 'parallel_groups')
+        col.prop(flock_props, 'parallel_slabs')
+        if flock_props.parallel_groups or flock_props.parallel_slabs:
+            col.prop(flock_props, 'num_workers')
         row = layout.row()
         row.operator('flock.gen_flock', text='Generate')
\ No newline at end of file
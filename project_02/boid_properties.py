@@ -1,4 +1,4 @@
-from bpy.props import IntProperty, FloatProperty
+from bpy.props import IntProperty, FloatProperty, BoolProperty
 from bpy.types import PropertyGroup
 
 
@@ -8,7 +8,8 @@ class FlockProperties(PropertyGroup):
         description='',
         default=100,
         min=0,
-        max=1000
+        soft_max=1000,
+        max=100000
     )
     x_range: IntProperty(
         name='X Range',
@@ -93,4 +94,26 @@ class FlockProperties(PropertyGroup):
         default=3,
         min=0,
         max=100
-    )
\ No newline at end of file
+    )
+    vectorized: BoolProperty(
+        name='Vectorized',
+        description='Step the whole flock at once with NumPy arrays',
+        default=False
+    )
+    parallel_groups: BoolProperty(
+        name='Parallel Groups',
+        description='Simulate each group in its own worker process, avoiding obstacles with NumPy ray casts',
+        default=False
+    )
+    parallel_slabs: BoolProperty(
+        name='Parallel Slabs',
+        description='Step the flock across worker processes, each stepping the boids in one slab of the region',
+        default=False
+    )
+    num_workers: IntProperty(
+        name='Workers',
+        description='Number of worker processes (0 for one per core)',
+        default=0,
+        min=0,
+        max=256
+    )
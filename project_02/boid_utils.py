@@ -1,6 +1,23 @@
 import bpy
 import mathutils
 import math
+import itertools
+import numpy as np
+
+from flock_obstacles import Obstacle, ObstacleMesh
+
+# Objects and materials the flock generator makes are tagged with this custom property,
+# so the next run reuses them instead of leaving orphans behind
+POOL_PROPERTY = 'generator_pool'
+FLOCK_POOL = 'flock'
+# Names of the meshes shared by every object of a kind
+BOID_CONE_MESH = 'boid_cone'
+POINT_MESH = 'projection_point'
+REGION_CUBE = 'REGION_CUBE'
+# Corners of a unit cube in the order primitive_cube_add makes its vertices
+UNIT_CUBE_CORNERS = np.array(list(itertools.product((-1.0, 1.0), repeat=3)))
+# Pool the sea sponge generator tags the objects of its reef with
+REEF_POOL = 'sea_sponge'
 
 def generate_cylinder(point1, point2, r):
     dx = point2.x - point1.x
@@ -21,27 +38,84 @@ def generate_cylinder(point1, point2, r):
     bpy.context.object.rotation_euler[2] = phi
     return bpy.context.object, bpy.ops.object
 
-def generate_boid_cone(mat, loc, vel):
-    bpy.ops.mesh.primitive_cone_add(radius1=0.025, depth=0.1)
-    cone = bpy.context.object
+def get_material(name, color):
+    """ Material called name, reused from an earlier run if it exists, with its
+        color set and any animation from that run cleared
+    """
+    mat = bpy.data.materials.get(name)
+    if mat is None:
+        mat = bpy.data.materials.new(name)
+        mat[POOL_PROPERTY] = FLOCK_POOL
+    mat.animation_data_clear()
+    mat.diffuse_color = color
+    return mat
+
+def get_primitive_mesh(name, add_primitive, **kwargs):
+    """ Mesh called name, made once with a primitive operator and shared by every object using it """
+    mesh = bpy.data.meshes.get(name)
+    if mesh is None:
+        add_primitive(**kwargs)
+        obj = bpy.context.object
+        mesh = obj.data
+        mesh.name = name
+        bpy.data.objects.remove(obj)
+    return mesh
+
+def get_object(name, mesh):
+    """ Object called name showing mesh, reused from an earlier run if it exists """
+    obj = bpy.data.objects.get(name)
+    if obj is None or obj.get(POOL_PROPERTY) != FLOCK_POOL:
+        obj = bpy.data.objects.new(name, mesh)
+        obj[POOL_PROPERTY] = FLOCK_POOL
+    else:
+        obj.data = mesh
+        obj.parent = None
+        obj.animation_data_clear()
+    if obj.name not in bpy.context.scene.collection.objects:
+        bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+def release_flock(keep):
+    """ Remove the flock objects and materials of earlier runs whose names are not in keep """
+    for obj in list(bpy.data.objects):
+        if obj.get(POOL_PROPERTY) == FLOCK_POOL and obj.name not in keep:
+            bpy.data.objects.remove(obj)
+    for mat in list(bpy.data.materials):
+        if mat.get(POOL_PROPERTY) == FLOCK_POOL and mat.name not in keep and mat.users == 0:
+            bpy.data.materials.remove(mat)
+
+def generate_boid_cone(mat, loc, vel, name="boid"):
+    # every boid shares one cone mesh, its material is linked to the object instead
+    mesh = get_primitive_mesh(BOID_CONE_MESH, bpy.ops.mesh.primitive_cone_add, radius1=0.025, depth=0.1)
+    if len(mesh.materials) == 0:
+        mesh.materials.append(None)
+    cone = get_object(name, mesh)
     cone.location = loc
     
-    cone.data.materials.append(mat)
+    cone.material_slots[0].link = 'OBJECT'
+    cone.material_slots[0].material = mat
     
     return cone
 
 def gen_region_cube(x_scale, y_scale, z_scale):
-    bpy.ops.mesh.primitive_cube_add(scale=(x_scale, y_scale, z_scale), align='WORLD', location=(0.0, 0.0, 0.0))
-    obj = bpy.context.object
+    mesh = get_primitive_mesh(REGION_CUBE, bpy.ops.mesh.primitive_cube_add, align='WORLD', location=(0.0, 0.0, 0.0))
+    # The size goes into the mesh, as boids ray cast in the cube's own space with a world
+    # space perception radius. The shared mesh keeps the last run's size, which may be 0
+    # along an axis, so its corners are placed from the unit cube rather than scaled
+    co = UNIT_CUBE_CORNERS * (x_scale, y_scale, z_scale)
+    mesh.vertices.foreach_set('co', co.ravel())
+    mesh.update()
+    obj = get_object(REGION_CUBE, mesh)
+    obj.scale = (1, 1, 1)
     if "transparent" in bpy.data.materials:
         mat = bpy.data.materials["transparent"]
     else:
         mat = bpy.data.materials.new("transparent")
     mat.diffuse_color = (1, 1, 1, 0.05)
     mat.blend_method = 'OPAQUE'
-    obj.data.materials.append(mat)
+    if len(mesh.materials) == 0:
+        mesh.materials.append(mat)
     obj.show_transparent = True 
-    obj.name = "REGION_CUBE"
     return obj
 
 def clear_scene():
@@ -54,6 +128,15 @@ def angle_between_vectors(vector1, vector2):
     term3 = math.sqrt((vector2.x ** 2) + (vector2.y ** 2) + (vector2.z ** 2))
     return math.acos(term1 / (term2 * term3))
 
+def within_angle(dot, length1_sq, length2_sq, cos_angle):
+    """ Whether the angle between two vectors is less than the angle with cosine cos_angle,
+        from their dot product and squared lengths, without sqrt or acos
+    """
+    bound = cos_angle * cos_angle * length1_sq * length2_sq
+    if cos_angle >= 0:
+        return dot > 0 and dot * dot > bound
+    return dot >= 0 or dot * dot < bound
+
 def dist(point1: mathutils.Vector, point2: mathutils.Vector) -> float:
     """Calculate distance between two points in 3D."""
     return (point2 - point1).length
@@ -75,6 +158,9 @@ def project_points():
     pow = 0.5
     start_color = (0, 0, 0, 1)
     points = []
+    mesh = get_primitive_mesh(POINT_MESH, bpy.ops.mesh.primitive_ico_sphere_add, align='WORLD', radius=.01)
+    if len(mesh.materials) == 0:
+        mesh.materials.append(get_material("point_mat", (1, 0, .28, 1)))
     for i in range(0, num_points):
         t = i / (num_points - 1)
         inc = math.acos(1 - 2 * t)
@@ -83,12 +169,93 @@ def project_points():
         x = math.sin(inc) * math.cos(a)
         y = math.sin(inc) * math.sin(a)
         z = math.cos(inc)
-        bpy.ops.mesh.primitive_ico_sphere_add(align='WORLD', location=(x, y, z), radius=.01)
-        
-        obj = bpy.context.object
-        if i == 0:
-            point_mat = bpy.data.materials.new("point_mat")
-            point_mat.diffuse_color = (1, 0, .28, 1)
-            obj.data.materials.append(point_mat)
+        obj = get_object(f"projection_point_{i}", mesh)
+        obj.location = (x, y, z)
         points.append(obj)
     return points
+
+def obstacle_mesh(mesh):
+    """ Triangles of mesh in its own space, sorted for ray casts outside Blender """
+    mesh.calc_loop_triangles()
+    verts = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts)
+    tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('vertices', tris)
+    return ObstacleMesh(verts.reshape(-1, 3)[tris])
+
+
+def obstacles_from_objects(objects):
+    """ An obstacle for each object, for ray casts outside Blender. Objects sharing a mesh,
+        as linked duplicates and collection instances do, share one ObstacleMesh, so
+        each mesh is read and sorted once
+    """
+    meshes = {}
+    obstacles = []
+    for obj in objects:
+        if obj.data.name not in meshes:
+            meshes[obj.data.name] = obstacle_mesh(obj.data)
+        obstacles.append(Obstacle(meshes[obj.data.name], np.array(obj.matrix_world)))
+    return obstacles
+
+
+def obstacle_bounds(objects):
+    """ For each object, its world matrix's inverse and a sphere around its mesh in its own
+        space, as (matrix_inverse, center, radius). A ray cast in the object's space can
+        only hit the mesh if it comes within radius of center. Spheres are worked out
+        once per mesh, so linked duplicates share theirs
+    """
+    spheres = {}
+    bounds = []
+    for obj in objects:
+        mesh = obj.data
+        if mesh.name not in spheres:
+            verts = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+            mesh.vertices.foreach_get('co', verts)
+            verts = verts.reshape(-1, 3)
+            if len(verts):
+                low, high = verts.min(axis=0).astype(float), verts.max(axis=0).astype(float)
+                radius = float(np.linalg.norm(high - low)) / 2
+                # padded so rays grazing the mesh are still cast
+                spheres[mesh.name] = (mathutils.Vector((low + high) / 2), radius + 1e-6 * (1 + radius))
+            else:
+                spheres[mesh.name] = (mathutils.Vector((0, 0, 0)), -math.inf)
+        bounds.append((obj.matrix_world.inverted(),) + spheres[mesh.name])
+    return bounds
+
+
+class InstancedObject(object):
+    """ One mesh object of a collection instance, seen as an object of its own. It has the
+        mesh of the instanced object and the world matrix it is drawn with, and ray casts
+        in its mesh's space like Object.ray_cast, so boids and obstacles_from_objects can
+        use it in place of a scene object
+    """
+    def __init__(self, instancer, obj):
+        self.name = f"{instancer.name}/{obj.name}"
+        self.object = obj
+        self.data = obj.data
+        offset = mathutils.Matrix.Translation(-instancer.instance_collection.instance_offset)
+        self.matrix_world = instancer.matrix_world @ offset @ obj.matrix_world
+
+    def ray_cast(self, origin, direction, distance=1.70141e+38):
+        # the instanced object sits in a collection outside the view layer, its evaluated
+        # copy is the one with a mesh to cast against
+        evaluated = self.object.evaluated_get(bpy.context.evaluated_depsgraph_get())
+        return evaluated.ray_cast(origin, direction, distance=distance)
+
+
+def reef_objects(scene):
+    """ Mesh objects of the sea sponge reef in scene, whichever reef mode built it:
+        the sponges themselves, linked duplicates sharing a mesh, and the objects
+        instanced by collection instance empties
+    """
+    objects = []
+    for obj in scene.objects:
+        if obj.get(POOL_PROPERTY) != REEF_POOL:
+            continue
+        if obj.type == 'MESH':
+            objects.append(obj)
+        elif obj.type == 'EMPTY' and obj.instance_type == 'COLLECTION' and obj.instance_collection is not None:
+            objects.extend(
+                InstancedObject(obj, instanced) for instanced in obj.instance_collection.all_objects
+                if instanced.type == 'MESH')
+    return objects
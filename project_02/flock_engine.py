@@ -0,0 +1,309 @@
+import numpy as np
+import math
+from types import SimpleNamespace
+
+# Flocking for a whole flock at once. Every boid's state lives in (N,3) float arrays
+# plus a group id per boid, and a step computes the steering of all boids with array
+# reductions over their neighbors. The rules are the ones of boid.Boid: the same
+# perception test, set_mag / limit clamping, avoidance delay and priority ordered
+# acceleration budget, and the same wrapping in edges().
+# All boids flock against the state at the start of the step and then update together.
+# No bpy is needed here. Obstacles are avoided either with steering the caller computes
+# or with flock_obstacles ray casts, which also work in worker processes.
+
+# frames a boid ignores the flock after finding an obstacle, as in boid.py
+AVOIDANCE_DELAY = 5
+# boids whose neighbors are reduced at a time, bounding the (B,M,3) temporaries
+NEIGHBOR_CHUNK = 128
+# projection points tried at a time when steering around an obstacle, their rays cast together
+POINT_BLOCK = 16
+# flock properties an engine reads
+SETTINGS = [
+    'x_range', 'y_range', 'z_range', 'perception_radius', 'perception_angle',
+    'alignment_strength', 'cohesion_strength', 'separation_strength',
+    'max_velocity', 'max_acceleration'
+]
+
+# obstacles and projection points the simulations of a worker process avoid, set once when it starts
+worker_obstacles = ((), ())
+
+
+def lengths(vectors):
+    return np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+
+
+def unit(vectors):
+    """ Row-wise Vector.normalized, zero rows stay zero """
+    return set_mag(vectors, 1.0)
+
+
+def set_mag(vectors, mag):
+    """ Row-wise utils.set_mag, zero rows stay zero """
+    length = lengths(vectors)
+    scale = np.divide(mag, length, out=np.zeros_like(length), where=length != 0)
+    return vectors * scale[:, None]
+
+
+def limit(vectors, mag):
+    """ Row-wise utils.limit """
+    over = lengths(vectors) > mag
+    limited = vectors.copy()
+    limited[over] = set_mag(vectors[over], mag[over] if np.ndim(mag) else mag)
+    return limited
+
+
+def ordered_sum(terms):
+    """ Sum of (B,M,3) terms over M, added one after another in index order. A boid's sums
+        then do not depend on which other boids are present, since a boid it does not
+        perceive only adds an exact zero, so any subset of the flock that contains a
+        boid's neighbors gives the same bits
+    """
+    if terms.shape[1] == 0:
+        return np.zeros((len(terms), 3))
+    return np.add.accumulate(terms, axis=1)[:, -1]
+
+
+def flock_settings(flock_props):
+    """ Plain copy of the settings an engine reads, which can be sent to other processes """
+    return SimpleNamespace(**{name: getattr(flock_props, name) for name in SETTINGS})
+
+
+class FlockEngine(object):
+    def __init__(self, positions, velocities, groups, flock_props):
+        self.positions = np.array(positions, dtype=float).reshape(-1, 3)
+        self.velocities = np.array(velocities, dtype=float).reshape(-1, 3)
+        self.accelerations = np.zeros_like(self.positions)
+        self.groups = np.array(groups, dtype=int)
+        self.avoidance_delay = np.zeros(len(self.positions), dtype=int)
+
+        # plain copies of the settings, so an engine does not hold on to Blender data
+        self.ranges = np.array([flock_props.x_range, flock_props.y_range, flock_props.z_range], dtype=float)
+        self.perception_radius = flock_props.perception_radius
+        self.perception_cos = math.cos(math.radians(flock_props.perception_angle))
+        self.alignment_strength = flock_props.alignment_strength
+        self.cohesion_strength = flock_props.cohesion_strength
+        self.separation_strength = flock_props.separation_strength
+        self.max_velocity = flock_props.max_velocity
+        self.max_acceleration = flock_props.max_acceleration
+
+    @classmethod
+    def from_boids(cls, boids, flock_props):
+        engine = cls(
+            [tuple(boid.position) for boid in boids],
+            [tuple(boid.velocity) for boid in boids],
+            [boid.group for boid in boids],
+            flock_props
+        )
+        engine.avoidance_delay[:] = [boid.avoidance_delay for boid in boids]
+        return engine
+
+    def select(self, rows):
+        """ Indices of the boids a step works on, every boid by default """
+        return np.arange(len(self.positions)) if rows is None else np.asarray(rows, dtype=int)
+
+    def neighbor_sums(self, rows=None):
+        """ Per boid of rows, the number of boids in perception and the sums over them of
+            velocity, position and separation (unit vector away from the other boid).
+            Boids are split by group first, then tested on squared distance and on a
+            dot product against the cosine of the perception angle, without sqrt or
+            arccos; square roots are only taken for the separation of perceived pairs
+        """
+        rows = self.select(rows)
+        counts = np.zeros(len(rows))
+        velocity_sums = np.zeros((len(rows), 3))
+        position_sums = np.zeros((len(rows), 3))
+        separation_sums = np.zeros((len(rows), 3))
+        radius_sq = self.perception_radius ** 2
+        bound_scale = self.perception_cos ** 2
+
+        # boids only perceive their own group
+        row_groups = self.groups[rows]
+        # chunks of nearby boids only need to look at the members around them
+        cells = np.floor(self.positions[rows] / max(self.perception_radius, 1e-6)).astype(int)
+        order = np.lexsort(cells.T[::-1])
+        for group in np.unique(row_groups):
+            targets = order[row_groups[order] == group]
+            members = np.flatnonzero(self.groups == group)
+            for start in range(0, len(targets), NEIGHBOR_CHUNK):
+                chunk = targets[start:start + NEIGHBOR_CHUNK]
+                boids = rows[chunk]
+                low = self.positions[boids].min(axis=0) - self.perception_radius
+                high = self.positions[boids].max(axis=0) + self.perception_radius
+                near = members[np.all((self.positions[members] >= low) & (self.positions[members] <= high), axis=1)]
+                positions = self.positions[near]
+                velocities = self.velocities[near]
+                diff = positions[None, :, :] - self.positions[boids, None, :]
+                dist_sq = np.einsum('bmk,bmk->bm', diff, diff)
+                dot = np.einsum('bk,bmk->bm', self.velocities[boids], diff)
+                bound = bound_scale * np.einsum('bk,bk->b', self.velocities[boids], self.velocities[boids])[:, None] * dist_sq
+                # the same cone test as utils.within_angle
+                if self.perception_cos >= 0:
+                    within_angle = (dot > 0) & (dot * dot > bound)
+                else:
+                    within_angle = (dot >= 0) | (dot * dot < bound)
+                perceived = (dist_sq < radius_sq) & within_angle & (near[None, :] != boids[:, None])
+
+                # only the boids someone in the chunk perceives contribute
+                used = np.flatnonzero(perceived.any(axis=0))
+                perceived = perceived[:, used]
+                weights = np.zeros(perceived.shape)
+                weights[perceived] = 1 / np.sqrt(dist_sq[:, used][perceived])
+
+                counts[chunk] = perceived.sum(axis=1)
+                velocity_sums[chunk] = ordered_sum(perceived[:, :, None] * velocities[None, used])
+                position_sums[chunk] = ordered_sum(perceived[:, :, None] * positions[None, used])
+                separation_sums[chunk] = -ordered_sum(weights[:, :, None] * diff[:, used])
+
+        return counts, velocity_sums, position_sums, separation_sums
+
+    def steer(self, sums, counts, velocities, offset=None):
+        """ Boid.steer from a sum over perceived boids, for boids with the given velocities """
+        steering = np.zeros_like(sums)
+        some = counts > 0
+        steering[some] = sums[some] * (1 / counts[some])[:, None]
+        if offset is not None:
+            steering[some] -= offset[some]
+        steering[some] = set_mag(steering[some], self.max_velocity)
+        steering[some] -= velocities[some]
+        steering[some] = limit(steering[some], self.max_acceleration)
+        return steering
+
+    def avoidance(self, obstacles, points, rows=None):
+        """ Boid.avoidance for the boids of rows, with flock_obstacles.Obstacle ray casts.
+            Returns their (R,3) avoidance steering and which of them found an obstacle
+            ahead. points are the world locations of the projection points, read as
+            Boid.steer_around reads them
+        """
+        rows = self.select(rows)
+        positions = self.positions[rows]
+        velocities = self.velocities[rows]
+        headings = unit(velocities)
+        local_positions = [obstacle.to_local(positions) for obstacle in obstacles]
+
+        # Boid.find_obstacle ranks hits by the distance from the boid's location to
+        # result[2] of Object.ray_cast, which is the hit normal, so the same is done here
+        min_dist = np.full(len(rows), 100000000.0)
+        closest = np.full(len(rows), -1)
+        for index, obstacle in enumerate(obstacles):
+            hit, _, normals = obstacle.ray_cast(local_positions[index], headings, self.perception_radius)
+            dist = lengths(normals - positions)
+            closer = hit & (dist < min_dist)
+            min_dist[closer] = dist[closer]
+            closest[closer] = index
+
+        # steer towards the first projection point with a clear path past the obstacle
+        steering = np.zeros((len(rows), 3))
+        avoiding = closest >= 0
+        unresolved = avoiding.copy()
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        for block in range(0, len(points), POINT_BLOCK):
+            if not unresolved.any():
+                break
+            block_points = points[block:block + POINT_BLOCK]
+            for index, obstacle in enumerate(obstacles):
+                boids = np.flatnonzero(unresolved & (closest == index))
+                if len(boids) == 0:
+                    continue
+                offsets = block_points[None, :, :] - positions[boids, None, :]
+                hit, _, _ = obstacle.ray_cast(np.repeat(local_positions[index][boids], len(block_points), axis=0),
+                    unit(offsets.reshape(-1, 3)), self.perception_radius, any_hit=True)
+                clear = ~hit.reshape(len(boids), len(block_points))
+                found = clear.any(axis=1)
+                first = clear.argmax(axis=1)[found]
+                boids = boids[found]
+                offsets = offsets[found, first]
+                steering[boids] = set_mag(offsets, self.max_velocity) - velocities[boids]
+                steering[boids] = limit(steering[boids], self.max_acceleration)
+                unresolved[boids] = False
+        return steering, avoiding
+
+    def flock(self, avoidance=None, avoiding=None, rows=None):
+        """ Accelerations of the boids of rows, like Boid.flock.
+            avoidance is their (R,3) avoidance steering and avoiding marks the ones that
+            found an obstacle ahead this frame
+        """
+        rows = self.select(rows)
+        positions = self.positions[rows]
+        velocities = self.velocities[rows]
+        counts, velocity_sums, position_sums, separation_sums = self.neighbor_sums(rows)
+        alignment = self.steer(velocity_sums, counts, velocities) * self.alignment_strength
+        cohesion = self.steer(position_sums, counts, velocities, positions) * self.cohesion_strength
+        separation = self.steer(separation_sums, counts, velocities) * self.separation_strength
+
+        if avoidance is None:
+            avoidance = np.zeros((len(rows), 3))
+        delay = self.avoidance_delay[rows]
+        if avoiding is not None:
+            delay[avoiding] = AVOIDANCE_DELAY
+
+        total_mag = lengths(avoidance)
+        accelerations = self.accelerations[rows] + avoidance
+        delayed = delay != 0
+        delay[delayed] -= 1
+
+        # the budget is spent on separation, then cohesion, then alignment; the first
+        # rule that does not fit is scaled to the remaining budget and the rest are dropped
+        remaining = ~delayed
+        for steering in (separation, cohesion, alignment):
+            budget = self.max_acceleration - total_mag
+            over = remaining & (total_mag + lengths(steering) > self.max_acceleration)
+            accelerations[over] += set_mag(steering[over], budget[over])
+            fits = remaining & ~over
+            accelerations[fits] += steering[fits]
+            remaining = fits
+
+        self.accelerations[rows] = accelerations
+        self.avoidance_delay[rows] = delay
+
+    def update(self, rows=None):
+        rows = self.select(rows)
+        self.positions[rows] += self.velocities[rows]
+        velocities = self.velocities[rows] + self.accelerations[rows]
+        self.velocities[rows] = limit(velocities, self.max_velocity)
+        self.accelerations[rows] = 0
+
+    def edges(self, rows=None):
+        """ Wrap boids leaving the region to the opposite side, like Boid.edges """
+        rows = self.select(rows)
+        positions = self.positions[rows]
+        above = positions >= self.ranges
+        below = (positions <= -self.ranges) & ~above
+        positions[above] = np.broadcast_to(-self.ranges, positions.shape)[above]
+        positions[below] = np.broadcast_to(self.ranges, positions.shape)[below]
+        self.positions[rows] = positions
+
+    def step(self, avoidance=None, avoiding=None, wrap=False, rows=None):
+        """ Flock and then update the boids of rows, every boid by default.
+            Every boid's next state depends only on the state before the step
+        """
+        self.flock(avoidance, avoiding, rows)
+        self.update(rows)
+        if wrap:
+            self.edges(rows)
+
+
+def init_simulation(obstacles, points):
+    """ Set the obstacles and projection points every job of a worker process avoids.
+        They are passed once per worker as its initializer's arguments, instead of
+        pickled into every job
+    """
+    global worker_obstacles
+    worker_obstacles = (obstacles, points)
+
+
+def simulate(job):
+    """ Run a flock for job['frames'] frames, avoiding the obstacles init_simulation set,
+        and return its positions and velocities after every frame as (frames,N,3) arrays.
+        Runs in worker processes, one job per group of boids
+    """
+    obstacles, points = worker_obstacles
+    engine = FlockEngine(job['positions'], job['velocities'], job['groups'], job['settings'])
+    engine.avoidance_delay[:] = job['avoidance_delay']
+    positions = np.empty((job['frames'],) + engine.positions.shape)
+    velocities = np.empty_like(positions)
+    for frame in range(job['frames']):
+        avoidance, avoiding = engine.avoidance(obstacles, points)
+        engine.step(avoidance, avoiding)
+        positions[frame] = engine.positions
+        velocities[frame] = engine.velocities
+    return {'positions': positions, 'velocities': velocities}
@@ -0,0 +1,231 @@
+import numpy as np
+
+import mesh_merge
+
+# Ray casts against static obstacles with NumPy, so flocks can avoid them outside
+# Blender, in worker processes. An obstacle is a mesh's triangles in its own space
+# together with an object's world matrix, and rays are cast in that space as
+# Object.ray_cast casts them. No bpy is needed here, boid_utils.obstacles_from_objects
+# builds obstacles from objects.
+# An ObstacleMesh sorts its triangles into a bounding volume hierarchy once, so a ray is
+# only tested against the few triangles whose boxes its segment passes through, instead
+# of every triangle of a reef. Objects sharing a mesh, as linked duplicates and the
+# objects of collection instances do, share one ObstacleMesh, which pickle also sends
+# only once with a list of obstacles.
+
+# ray-triangle pairs tested at a time, bounding the (P,3) temporaries
+PAIR_CHUNK = 2**18
+# rays walked down an obstacle's hierarchy at a time, bounding the pairs they collect
+RAY_CHUNK = 2**14
+# determinants below this are rays parallel to a triangle
+PARALLEL_EPSILON = 1e-12
+# most triangles in a leaf of the hierarchy
+LEAF_SIZE = 8
+
+
+def ray_triangle_distances(origins, directions, v0, e1, e2, distance):
+    """ Distance along each ray to the triangle paired with it, given by its first vertex
+        and two edges, or inf where the ray misses it within distance. Both sides count.
+        All arguments but distance are (P,3), one row per ray-triangle pair
+    """
+    # Moller-Trumbore
+    p = np.cross(directions, e2)
+    det = np.einsum('ij,ij->i', p, e1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1 / det
+        s = origins - v0
+        u = np.einsum('ij,ij->i', s, p) * inv_det
+        q = np.cross(s, e1)
+        v = np.einsum('ij,ij->i', directions, q) * inv_det
+        t = np.einsum('ij,ij->i', q, e2) * inv_det
+        hit = (np.abs(det) > PARALLEL_EPSILON) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= distance)
+    return np.where(hit, t, np.inf)
+
+
+def nearest_hits(origins, directions, v0, e1, e2, distance, rays, tris, nearest, nearest_tri):
+    """ Update each ray's nearest hit so far, its distance in nearest and its triangle in
+        nearest_tri, with the ray-triangle pairs (rays, tris). Of hits at the same distance
+        the lowest triangle wins, so the result does not depend on the order pairs come in
+    """
+    for start in range(0, len(rays), PAIR_CHUNK):
+        chunk_rays = rays[start:start + PAIR_CHUNK]
+        chunk_tris = tris[start:start + PAIR_CHUNK]
+        # hits beyond a ray's nearest one so far cannot be nearer
+        t = ray_triangle_distances(origins[chunk_rays], directions[chunk_rays],
+            v0[chunk_tris], e1[chunk_tris], e2[chunk_tris], np.minimum(nearest[chunk_rays], distance))
+        found = np.isfinite(t)
+        chunk_rays, chunk_tris, t = chunk_rays[found], chunk_tris[found], t[found]
+        if len(t) == 0:
+            continue
+        # the closest hit of each ray in the chunk, then the lowest triangle
+        order = np.lexsort((chunk_tris, t, chunk_rays))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = chunk_rays[order[1:]] != chunk_rays[order[:-1]]
+        best = order[first]
+        best_rays, best_tris, best_t = chunk_rays[best], chunk_tris[best], t[best]
+        closer = (best_t < nearest[best_rays]) | ((best_t == nearest[best_rays]) & (best_tris < nearest_tri[best_rays]))
+        nearest[best_rays[closer]] = best_t[closer]
+        nearest_tri[best_rays[closer]] = best_tris[closer]
+
+
+def hit_results(origins, directions, e1, e2, nearest, nearest_tri):
+    """ The (R,) hit mask and the (R,3) hit locations and normals of rays' nearest hits,
+        the normal of a triangle following its winding
+    """
+    hit = np.isfinite(nearest)
+    # misses are at the origin, as Object.ray_cast returns them
+    locations = np.zeros((len(nearest), 3))
+    locations[hit] = origins[hit] + directions[hit] * nearest[hit, None]
+    normals = np.zeros((len(nearest), 3))
+    normals[hit] = np.cross(e1[nearest_tri[hit]], e2[nearest_tri[hit]])
+    normals[hit] /= np.maximum(np.linalg.norm(normals[hit], axis=1), 1e-300)[:, None]
+    return hit, locations, normals
+
+
+def ray_triangles(origins, directions, triangles, distance):
+    """ Nearest hit of each ray with (T,3,3) triangles within distance, testing every ray
+        against every triangle. directions must be unit length. Returns what
+        ObstacleMesh.ray_cast returns for the same triangles
+    """
+    v0 = triangles[:, 0]
+    e1 = triangles[:, 1] - v0
+    e2 = triangles[:, 2] - v0
+    nearest = np.full(len(origins), np.inf)
+    nearest_tri = np.zeros(len(origins), dtype=int)
+    rays = np.repeat(np.arange(len(origins)), len(triangles))
+    tris = np.tile(np.arange(len(triangles)), len(origins))
+    nearest_hits(origins, directions, v0, e1, e2, distance, rays, tris, nearest, nearest_tri)
+    return hit_results(origins, directions, e1, e2, nearest, nearest_tri)
+
+
+def segments_in_box(origins, directions, distance, mins, maxs):
+    """ Which rays pass through the box within distance. mins and maxs are one box
+        for every ray, or (R,3) with a box per ray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = (mins - origins) / directions
+        t2 = (maxs - origins) / directions
+    near = np.fmin(t1, t2)
+    far = np.fmax(t1, t2)
+    # rays parallel to an axis are inside or outside the box's slab for that axis
+    parallel = directions == 0
+    inside = (origins >= mins) & (origins <= maxs)
+    near = np.where(parallel, np.where(inside, -np.inf, np.inf), near)
+    far = np.where(parallel, np.where(inside, np.inf, -np.inf), far)
+    return np.maximum(near.max(axis=1), 0) <= np.minimum(far.min(axis=1), distance)
+
+
+def build_hierarchy(lows, highs, pad):
+    """ Bounding volume hierarchy over boxes given by their (T,3) corners, split at the
+        median of their centers along the longest axis until at most LEAF_SIZE are left.
+        Returns the order of the boxes, which every node holds a range of, and the nodes'
+        padded bounds, ranges and first children, the second child following the first.
+        Leaves have no children (-1)
+    """
+    centers = (lows + highs) / 2
+    order = np.arange(len(lows))
+    mins, maxs, starts, counts, children = [], [], [], [], []
+
+    def add_node(start, end):
+        boxes = order[start:end]
+        mins.append(lows[boxes].min(axis=0) - pad)
+        maxs.append(highs[boxes].max(axis=0) + pad)
+        starts.append(start)
+        counts.append(end - start)
+        children.append(-1)
+        return len(starts) - 1
+
+    stack = [(add_node(0, len(order)), 0, len(order))] if len(order) else []
+    while stack:
+        node, start, end = stack.pop()
+        if end - start <= LEAF_SIZE:
+            continue
+        boxes = order[start:end]
+        box_centers = centers[boxes]
+        extent = box_centers.max(axis=0) - box_centers.min(axis=0)
+        axis = extent.argmax()
+        if extent[axis] == 0:
+            # boxes all centered on one point cannot be told apart
+            continue
+        middle = (end - start) // 2
+        order[start:end] = boxes[np.argpartition(box_centers[:, axis], middle)]
+        children[node] = add_node(start, start + middle)
+        add_node(start + middle, end)
+        stack.append((children[node], start, start + middle))
+        stack.append((children[node] + 1, start + middle, end))
+
+    return (order, np.array(mins).reshape(-1, 3), np.array(maxs).reshape(-1, 3),
+        np.array(starts, dtype=int), np.array(counts, dtype=int), np.array(children, dtype=int))
+
+
+class ObstacleMesh(object):
+    """ The triangles of a mesh in its own space and their hierarchy, shared by every
+        obstacle with that mesh
+    """
+    def __init__(self, triangles):
+        self.triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+        self.v0 = self.triangles[:, 0]
+        self.e1 = self.triangles[:, 1] - self.v0
+        self.e2 = self.triangles[:, 2] - self.v0
+        # padded so rays grazing a face still reach the triangle test
+        pad = 1e-6 * (1 + np.abs(self.triangles).max(initial=0))
+        (self.order, self.node_mins, self.node_maxs,
+            self.node_starts, self.node_counts, self.node_children) = build_hierarchy(
+            self.triangles.min(axis=1), self.triangles.max(axis=1), pad)
+
+    def leaf_pairs(self, rays, nodes):
+        """ Every ray paired with every triangle of its leaf """
+        counts = self.node_counts[nodes]
+        firsts = np.repeat(self.node_starts[nodes] - (np.cumsum(counts) - counts), counts)
+        return np.repeat(rays, counts), self.order[firsts + np.arange(counts.sum())]
+
+    def walk(self, origins, directions, distance, any_hit, nearest, nearest_tri):
+        """ Walk the rays down the hierarchy a level at a time, all at once, testing the
+            triangles of the leaves they reach and updating nearest and nearest_tri.
+            A ray only enters boxes before its nearest hit so far, and with any_hit
+            stops at its first hit
+        """
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=int)
+        while len(rays):
+            inside = segments_in_box(origins[rays], directions[rays], np.minimum(nearest[rays], distance),
+                self.node_mins[nodes], self.node_maxs[nodes])
+            rays, nodes = rays[inside], nodes[inside]
+            leaf = self.node_children[nodes] < 0
+            if leaf.any():
+                pair_rays, pair_tris = self.leaf_pairs(rays[leaf], nodes[leaf])
+                nearest_hits(origins, directions, self.v0, self.e1, self.e2, distance,
+                    pair_rays, pair_tris, nearest, nearest_tri)
+            inner = ~leaf
+            if any_hit:
+                inner &= np.isinf(nearest[rays])
+            rays = np.repeat(rays[inner], 2)
+            nodes = (self.node_children[nodes[inner]][:, None] + [0, 1]).ravel()
+
+    def ray_cast(self, origins, directions, distance, any_hit=False):
+        """ Like Object.ray_cast for many rays, with origins and directions in the mesh's
+            space. Returns the hit mask and the hit locations and normals in the mesh's space.
+            With any_hit only the mask is sure to be the same, a ray stopping at whichever
+            hit it finds first
+        """
+        nearest = np.full(len(origins), np.inf)
+        nearest_tri = np.zeros(len(origins), dtype=int)
+        if len(self.triangles):
+            for start in range(0, len(origins), RAY_CHUNK):
+                chunk = slice(start, start + RAY_CHUNK)
+                self.walk(origins[chunk], directions[chunk], distance, any_hit, nearest[chunk], nearest_tri[chunk])
+        return hit_results(origins, directions, self.e1, self.e2, nearest, nearest_tri)
+
+
+class Obstacle(object):
+    """ An object to ray cast against: its mesh and where its world matrix puts it """
+    def __init__(self, mesh, matrix_world):
+        self.mesh = mesh
+        self.matrix_inverse = np.linalg.inv(np.asarray(matrix_world, dtype=float))
+
+    def to_local(self, positions):
+        return mesh_merge.transform_verts(positions, self.matrix_inverse)
+
+    def ray_cast(self, origins, directions, distance, any_hit=False):
+        """ ObstacleMesh.ray_cast, with origins and directions in the obstacle's space """
+        return self.mesh.ray_cast(origins, directions, distance, any_hit)
@@ -0,0 +1,136 @@
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from flock_engine import FlockEngine, flock_settings
+from processes import process_context
+
+# Stepping one large flock across worker processes. Each frame the flock is cut along x
+# into slabs holding about the same number of boids, one per worker. A worker steps the
+# boids of its slab, reading the boids within perception_radius of it as a halo.
+# The flock's state lives in multiprocessing.shared_memory buffers: workers read the
+# frozen state of the current frame and write the next state of their own boids, which
+# replaces the current state once every slab is done.
+# Every boid's next state depends only on the frame's state, and FlockEngine adds up
+# neighbors in index order whatever subset of the flock it holds, so the result is the
+# same bits for any number of workers, and the same as a single FlockEngine.step.
+
+# shared arrays of a flock: name -> (columns, dtype)
+FIELDS = {
+    'positions': (3, np.float64),
+    'velocities': (3, np.float64),
+    'groups': (0, np.int64),
+    'avoidance_delay': (0, np.int64),
+    'next_positions': (3, np.float64),
+    'next_velocities': (3, np.float64),
+    'next_avoidance_delay': (0, np.int64)
+}
+
+# what a worker process steps against, set once when it starts
+worker_state = None
+
+
+class SharedFlock(object):
+    """ A flock's state in shared memory, created by the main process with names=None
+        and attached to by workers with the names of the created blocks
+    """
+    def __init__(self, num_boids, names=None):
+        self.num_boids = num_boids
+        self.owner = names is None
+        self.blocks = {}
+        self.arrays = {}
+        for field, (columns, dtype) in FIELDS.items():
+            shape = (num_boids, columns) if columns else (num_boids,)
+            if self.owner:
+                size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                block = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                # workers share the resource tracker of the main process, so the block
+                # is still only unlinked by its owner
+                block = shared_memory.SharedMemory(name=names[field])
+            self.blocks[field] = block
+            self.arrays[field] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def names(self):
+        return {field: block.name for field, block in self.blocks.items()}
+
+    def close(self):
+        # views into a block must be gone before it can be closed
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+
+def init_worker(names, num_boids, settings, obstacles, points, wrap):
+    global worker_state
+    worker_state = (SharedFlock(num_boids, names), settings, obstacles, points, wrap)
+
+
+def step_slab(bounds):
+    """ Step the boids with low <= x < high, writing their next state """
+    flock, settings, obstacles, points, wrap = worker_state
+    arrays = flock.arrays
+    low, high = bounds
+    x = arrays['positions'][:, 0]
+    # boids further than the perception radius from the slab cannot be perceived from it
+    halo = np.flatnonzero((x >= low - settings.perception_radius) & (x < high + settings.perception_radius))
+    rows = np.flatnonzero((x[halo] >= low) & (x[halo] < high))
+    if len(rows) == 0:
+        return
+    engine = FlockEngine(arrays['positions'][halo], arrays['velocities'][halo], arrays['groups'][halo], settings)
+    engine.avoidance_delay[:] = arrays['avoidance_delay'][halo]
+    avoidance, avoiding = engine.avoidance(obstacles, points, rows)
+    engine.step(avoidance, avoiding, wrap, rows)
+
+    boids = halo[rows]
+    arrays['next_positions'][boids] = engine.positions[rows]
+    arrays['next_velocities'][boids] = engine.velocities[rows]
+    arrays['next_avoidance_delay'][boids] = engine.avoidance_delay[rows]
+
+
+class SlabFlock(object):
+    def __init__(self, positions, velocities, groups, flock_props, obstacles=(), points=(),
+                 num_workers=0, avoidance_delay=None, wrap=False):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.shared = SharedFlock(len(groups))
+        arrays = self.shared.arrays
+        arrays['positions'][:] = np.reshape(positions, (-1, 3))
+        arrays['velocities'][:] = np.reshape(velocities, (-1, 3))
+        arrays['groups'][:] = groups
+        arrays['avoidance_delay'][:] = 0 if avoidance_delay is None else avoidance_delay
+
+        # every worker gets the obstacles once, with one copy of each mesh they share
+        initargs = (self.shared.names(), len(groups), flock_settings(flock_props), list(obstacles), list(points), wrap)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers, mp_context=process_context(), initializer=init_worker, initargs=initargs)
+
+    @property
+    def positions(self):
+        return self.shared.arrays['positions']
+
+    @property
+    def velocities(self):
+        return self.shared.arrays['velocities']
+
+    def slab_bounds(self):
+        """ Slabs along x with about the same number of boids each, covering all of x """
+        x = np.sort(self.positions[:, 0])
+        cuts = x[(np.arange(1, self.num_workers) * len(x)) // self.num_workers] if len(x) else []
+        edges = [-np.inf] + list(cuts) + [np.inf]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def step(self):
+        list(self.executor.map(step_slab, self.slab_bounds()))
+        # every boid was stepped by exactly one slab
+        arrays = self.shared.arrays
+        arrays['positions'][:] = arrays['next_positions']
+        arrays['velocities'][:] = arrays['next_velocities']
+        arrays['avoidance_delay'][:] = arrays['next_avoidance_delay']
+
+    def close(self):
+        self.executor.shutdown()
+        self.shared.close()
@@ -4,8 +4,10 @@ from bpy.props import PointerProperty, IntProperty, FloatProperty
 from bpy.types import Operator
 
 import mathutils
+import numpy as np
 
 import math
+from concurrent.futures import ProcessPoolExecutor
 
 # set up for importing python modules
 import sys
@@ -16,6 +18,10 @@ if not dir in sys.path:
 
 import boid_utils as utils
 from boid import Boid
+from spatial_grid import SpatialGrid
+from flock_engine import FlockEngine, flock_settings, init_simulation, simulate
+from flock_slabs import SlabFlock
+from processes import process_context
 
 
 
@@ -45,38 +51,160 @@ class GenFlock(Operator):
             self.flock_props.y_range,
             self.flock_props.z_range
         )
+        self.region_cube = region_cube
 
         
 #        bpy.ops.mesh.primitive_cube_add(scale=(5, 5, 5), align='WORLD', location=(0.0, 0.0, 0.0))
 #        obj = bpy.context.object
         
-        scene_objs = [region_cube, bpy.data.objects['sponge_0']]
+        # every sponge of the reef is an obstacle, instanced or not
+        scene_objs = [region_cube] + utils.reef_objects(context.scene)
+        self.scene_objects = scene_objs
         
         self.flock = []
         projection_points = utils.project_points()
+        self.projection_points = projection_points
+        obstacle_bounds = utils.obstacle_bounds(scene_objs)
         for x in range(0, self.flock_props.num_boids):
 
-            boid = Boid(self.flock_props, scene_objs, x, projection_points)
+            boid = Boid(self.flock_props, scene_objs, x, projection_points, obstacle_bounds)
             self.flock.append(boid)
+        
+        # boids and materials of an earlier, larger flock are no longer needed
+        keep = {boid.object.name for boid in self.flock} | {boid.mat.name for boid in self.flock}
+        keep |= {point.name for point in projection_points} | {region_cube.name}
+        utils.release_flock(keep)
             
         
     def generate(self, context):
         
+        grid = SpatialGrid(
+            self.flock_props.perception_radius,
+            self.flock_props.x_range,
+            self.flock_props.y_range,
+            self.flock_props.z_range
+        )
         for frame in range(0, self.flock_props.frames):
             context.scene.frame_set(frame)
+            grid.build(self.flock)
+            # every boid flocks against the same frame before any of them moves, so the
+            # result does not depend on the order boids are stepped in
+            for boid in self.flock:
+                boid.flock(self.flock, grid)
             for boid in self.flock:
-                boid.flock(self.flock)
                 boid.update()
                 boid.show()
             print(f"Frame {frame} COMPLETE")
-        
-        bpy.data.objects.remove(bpy.data.objects['REGION_CUBE'], do_unlink=True)
-        for point in self.flock[0].projection_points:
+    
+    def generate_vectorized(self, context):
+        engine = FlockEngine.from_boids(self.flock, self.flock_props)
+        for frame in range(0, self.flock_props.frames):
+            context.scene.frame_set(frame)
+            # obstacles are still ray cast per boid, against the scene objects
+            avoidance = np.zeros_like(engine.positions)
+            avoiding = np.zeros(len(self.flock), dtype=bool)
+            for index, boid in enumerate(self.flock):
+                obstacle = boid.find_obstacle()
+                if obstacle:
+                    avoidance[index] = boid.steer_around(obstacle)
+                    avoiding[index] = True
+            engine.step(avoidance, avoiding)
+            for index, boid in enumerate(self.flock):
+                boid.position = mathutils.Vector(engine.positions[index])
+                boid.velocity = mathutils.Vector(engine.velocities[index])
+                boid.show()
+            print(f"Frame {frame} COMPLETE")
+    
+    def get_obstacles(self):
+        """ Scene objects as obstacles and the projection point locations, for ray casts outside Blender.
+            They are read from what setup made rather than from a boid, as the flock may have none
+        """
+        obstacles = utils.obstacles_from_objects(self.scene_objects)
+        points = [tuple(point.matrix_world.to_translation()) for point in self.projection_points]
+        return obstacles, points
+    
+    def generate_groups(self, context):
+        """ Boids only perceive their own group, so each group is simulated on its own in a
+            worker process and the trajectories are keyframed together afterwards
+        """
+        settings = flock_settings(self.flock_props)
+        obstacles, points = self.get_obstacles()
+        groups = sorted({boid.group for boid in self.flock})
+        members = [[boid for boid in self.flock if boid.group == group] for group in groups]
+        jobs = []
+        for boids in members:
+            jobs.append({
+                'positions': [tuple(boid.position) for boid in boids],
+                'velocities': [tuple(boid.velocity) for boid in boids],
+                'groups': [boid.group for boid in boids],
+                'avoidance_delay': [boid.avoidance_delay for boid in boids],
+                'settings': settings,
+                'frames': self.flock_props.frames
+            })
+
+        # the obstacles go to each worker once rather than with every group's job
+        with ProcessPoolExecutor(max_workers=self.flock_props.num_workers or None, mp_context=process_context(),
+                initializer=init_simulation, initargs=(obstacles, points)) as executor:
+            trajectories = list(executor.map(simulate, jobs))
+
+        for frame in range(0, self.flock_props.frames):
+            context.scene.frame_set(frame)
+            for boids, trajectory in zip(members, trajectories):
+                for index, boid in enumerate(boids):
+                    boid.position = mathutils.Vector(trajectory['positions'][frame, index])
+                    boid.velocity = mathutils.Vector(trajectory['velocities'][frame, index])
+                    boid.show()
+            print(f"Frame {frame} COMPLETE")
+    
+    def generate_slabs(self, context):
+        """ Step the whole flock each frame across worker processes, in slabs along x """
+        obstacles, points = self.get_obstacles()
+        flock = SlabFlock(
+            [tuple(boid.position) for boid in self.flock],
+            [tuple(boid.velocity) for boid in self.flock],
+            [boid.group for boid in self.flock],
+            self.flock_props,
+            obstacles,
+            points,
+            self.flock_props.num_workers,
+            [boid.avoidance_delay for boid in self.flock]
+        )
+        try:
+            for frame in range(0, self.flock_props.frames):
+                context.scene.frame_set(frame)
+                flock.step()
+                for index, boid in enumerate(self.flock):
+                    boid.position = mathutils.Vector(flock.positions[index])
+                    boid.velocity = mathutils.Vector(flock.velocities[index])
+                    boid.show()
+                print(f"Frame {frame} COMPLETE")
+        finally:
+            flock.close()
+    
+    def cleanup(self):
+        """ Remove the region cube and projection points, which only the simulation needs """
+        if self.region_cube is not None:
+            bpy.data.objects.remove(self.region_cube, do_unlink=True)
+        for point in self.projection_points:
             bpy.data.objects.remove(point)
     
     def execute(self, context):
-        self.setup(context)
-        self.generate(context)
+        self.region_cube = None
+        self.scene_objects = []
+        self.projection_points = []
+        try:
+            self.setup(context)
+            if self.flock_props.parallel_slabs:
+                self.generate_slabs(context)
+            elif self.flock_props.parallel_groups:
+                self.generate_groups(context)
+            elif self.flock_props.vectorized:
+                self.generate_vectorized(context)
+            else:
+                self.generate(context)
+        finally:
+            # also when a run fails part way, so the next one starts from a clean scene
+            self.cleanup()
         
         return {'FINISHED'}
 
@@ -1,10 +1,12 @@
 import bpy
-import bmesh
 from bpy.types import Operator
+from bpy.app.handlers import persistent
 #from functools import reduce
 
-#import numpy as np
+import numpy as np
 import random
+import ast
+from concurrent.futures import ProcessPoolExecutor
 
 from math import *
 from mathutils import *
@@ -16,58 +18,198 @@ dir = os.path.dirname(bpy.data.filepath)
 if not dir in sys.path:
     sys.path.append(dir)
 
-# local module
+# local modules
 import utils
+import surface
+import palette
+import sponge_geometry
+import geometry_cache
+from processes import process_context
 
-class GenSeaSponge(Operator):
-    bl_idname = 'sea.gen_sea_sponge'
-    bl_label = 'Generate Sea Sponge'
-    bl_options = {'REGISTER', "UNDO"}
+# Custom properties of preview sponges: the repr of the full-resolution jobs
+# they were built from, and while rendering, the name of the swapped out preview mesh
+PREVIEW_JOBS = 'sponge_preview_jobs'
+PREVIEW_MESH = 'sponge_preview_mesh'
+# Scene custom property keeping the Lock Interface setting from before preview sponges forced it on
+LOCK_INTERFACE = 'sponge_lock_interface'
+# Pool of the objects and collections a Generate owns, reused by the next Generate
+SPONGE_POOL = 'sea_sponge'
+
+# Worker processes for parallel generation, kept between runs since starting them is slow
+pool = None
+pool_workers = None
+
+
+def get_pool(num_workers):
+    """ Process pool with num_workers workers (0 for one per core) """
+    global pool, pool_workers
+    if pool is None or pool_workers != num_workers:
+        shutdown_pool()
+        pool = ProcessPoolExecutor(max_workers=num_workers or None, mp_context=process_context())
+        pool_workers = num_workers
+    return pool
+
+
+def shutdown_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+
+def swap_in_full_resolution(scene):
+    """ Replace the mesh of every preview sponge, and of its linked duplicates,
+        with full-resolution geometry built from the jobs stored on it
+    """
+    builder = SpongeBuilder()
+    builder.sea_sponge_props = scene.sea_sponge_properties
+    builder.store_props = False
+    # prototypes of collection instances are not in the scene, so look at all objects
+    full_meshes = {}
+    for obj in bpy.data.objects:
+        if obj.type == 'MESH' and PREVIEW_JOBS in obj and PREVIEW_MESH not in obj and obj.data.name not in full_meshes:
+            jobs = ast.literal_eval(obj[PREVIEW_JOBS])
+            data = builder.merge_sponge_data(jobs, builder.build_geometries(jobs))
+            mesh = bpy.data.meshes.new(obj.data.name + '_full')
+            utils.mesh_from_arrays(mesh, data['verts'], data['loops'], data['loop_start'], data['loop_total'])
+            utils.set_face_data(mesh, data)
+            full_meshes[obj.data.name] = mesh
+
+    for obj in bpy.data.objects:
+        if obj.type == 'MESH' and obj.data.name in full_meshes:
+            obj[PREVIEW_MESH] = obj.data.name
+            obj.data = full_meshes[obj[PREVIEW_MESH]]
+
+
+def swap_out_full_resolution():
+    """ Give preview sponges their preview meshes back and drop the full-resolution ones """
+    full_meshes = set()
+    for obj in bpy.data.objects:
+        if PREVIEW_MESH in obj:
+            full_meshes.add(obj.data.name)
+            obj.data = bpy.data.meshes[obj[PREVIEW_MESH]]
+            del obj[PREVIEW_MESH]
+    for name in full_meshes:
+        mesh = bpy.data.meshes[name]
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+
+def lock_interface(scene):
+    """ Lock the interface while rendering a scene with preview sponges. Their meshes are
+        swapped from the render thread, which is only safe while the interface is locked
+    """
+    if LOCK_INTERFACE not in scene:
+        scene[LOCK_INTERFACE] = scene.render.use_lock_interface
+    scene.render.use_lock_interface = True
+
+
+def unlock_interface(scene):
+    """ Give back the Lock Interface setting from before the scene had preview sponges """
+    if LOCK_INTERFACE in scene:
+        scene.render.use_lock_interface = bool(scene[LOCK_INTERFACE])
+        del scene[LOCK_INTERFACE]
+
+
+@persistent
+def render_init(scene, *args):
+    # without Blender's interface there is no other thread to race
+    if not (scene.render.use_lock_interface or bpy.app.background):
+        # the sea sponge panel warns about this before the render
+        print("Lock Interface is off, rendering preview sponges at their preview resolution")
+        return
+    swap_in_full_resolution(scene)
+
+
+@persistent
+def render_done(scene, *args):
+    swap_out_full_resolution()
+
+
+def register_handlers():
+    for handlers, handler in ((bpy.app.handlers.render_init, render_init),
+        (bpy.app.handlers.render_complete, render_done),
+        (bpy.app.handlers.render_cancel, render_done)):
+        if handler not in handlers:
+            handlers.append(handler)
+
+
+def unregister_handlers():
+    for handlers, handler in ((bpy.app.handlers.render_init, render_init),
+        (bpy.app.handlers.render_complete, render_done),
+        (bpy.app.handlers.render_cancel, render_done)):
+        if handler in handlers:
+            handlers.remove(handler)
+
+
+class SpongeBuilder:
+    """ Sponge construction shared by the operators and the render handlers.
+        Settings are read from self.sea_sponge_props
+    """
+    # whether building may write back to sea_sponge_props, which the render handlers must not
+    store_props = True
     
-    def make_rotund_cylinder(self):
-        """ Make a rotund cylinder """
-        
-        inner_r = self.sea_sponge_props.radius
-        outer_r = self.sea_sponge_props.rotundness
-        length = random.uniform(self.sea_sponge_props.min_height, self.sea_sponge_props.max_height)
-        res = self.sea_sponge_props.resolution
-        
-        range_u_min = -pi
-        range_u_max = pi
-        range_u_step = res
-        wrap_u = True
-        
-        range_v_min = -pi/2
-        range_v_max = pi/2
-        range_v_step = 4 * res
-        wrap_v = False
-            
-        z_shift = log(3*range_v_max)*length*range_v_max
-        
-        x_eq = "{}*cos({}*v)*cos(u)".format(inner_r, outer_r)
-        y_eq = "{}*cos({}*v)*sin(u)".format(inner_r, outer_r)
-        z_eq = "{0}*v*log((-v)+({1}))+{2}".format(length, 2*range_v_max, z_shift)
+    def get_sponge_job(self, rng):
+        """ Draw this sponge's random values from rng and collect every setting its geometry reads """
+        texturing_scheme = self.sea_sponge_props.texturing_scheme
+        length = rng.uniform(self.sea_sponge_props.min_height, self.sea_sponge_props.max_height)
+        bump_reducer = 1.0 if texturing_scheme == 'SMOOTH' else utils.get_bump_reducer(self.sea_sponge_props.bump_scale, rng)
+        use_lattice = self.sea_sponge_props.use_noise_lattice and texturing_scheme in ['TURBULENCE', 'STUCCO']
+        # rings follow the undisplaced profile only, noise relief needs the even ones
+        adaptive_rings = self.sea_sponge_props.adaptive_rings and not sponge_geometry.is_textured(
+            self.sea_sponge_props.species, texturing_scheme)
+        return {
+            'inner_r': self.sea_sponge_props.radius,
+            'outer_r': self.sea_sponge_props.rotundness,
+            'length': length,
+            'resolution': self.sea_sponge_props.resolution,
+            'ring_tolerance': self.sea_sponge_props.ring_tolerance if adaptive_rings else 0.0,
+            'species': self.sea_sponge_props.species,
+            'texturing_scheme': texturing_scheme,
+            'octaves': self.sea_sponge_props.turbulence_octaves,
+            'amplitude_scale': self.sea_sponge_props.turbulence_amplitude,
+            'frequency_scale': self.sea_sponge_props.turbulence_frequency,
+            'bump_reducer': bump_reducer,
+            'lattice_resolution': self.sea_sponge_props.noise_lattice_resolution if use_lattice else 0,
+            'lattice_bounds': self.get_lattice_bounds() if use_lattice else None,
+            'depth_shaded': self.sea_sponge_props.species != 'GLASS' and self.sea_sponge_props.shading_scheme != 'CUSTOM_MATTE',
+            'rotation': self.get_sponge_rotation(rng)
+        }
+
 
-        a_eq = b_eq = c_eq = d_eq = e_eq = f_eq = g_eq = h_eq = "0"
-        n=1
-        close_v = False
+    def make_rotund_cylinder(self, job):
+        """ Make a rotund cylinder """
         
-        xyz_surface = utils.xyz_function_surface_faces(x_eq, y_eq, z_eq,
-            range_u_min, range_u_max, range_u_step, wrap_u,
-            range_v_min, range_v_max, range_v_step, wrap_v,
-            a_eq, b_eq, c_eq, f_eq, g_eq, h_eq, n, close_v)
-        data = { 'verts': xyz_surface[0], 'edges': [], 'faces': xyz_surface[1] }
+        v_values = sponge_geometry.rotund_cylinder_v_values(job['inner_r'], job['outer_r'], job['length'],
+            job['resolution'], job['ring_tolerance'])
+        verts = sponge_geometry.rotund_cylinder_verts(job['inner_r'], job['outer_r'], job['length'], job['resolution'], v_values)
+        topology = sponge_geometry.sponge_topology(job['resolution'], len(verts) // job['resolution'] - 1)
+        # flat loop/polygon arrays let utils.object_from_data fill the mesh in bulk
+        data = {
+            'verts': verts,
+            'edges': [],
+            'faces': topology['faces'],
+            'loops': topology['loops'],
+            'loop_start': topology['loop_start'],
+            'loop_total': topology['loop_total']
+        }
         
         return data
     
     
-    def make_sponge(self, name):
-        """ Make a sponge """
+    def get_lattice_bounds(self):
+        """ Box for the baked noise lattice covering every sponge the current settings can produce """
+        radius = max(self.sea_sponge_props.min_radius, self.sea_sponge_props.max_radius)
+        height = max(self.sea_sponge_props.min_height, self.sea_sponge_props.max_height)
+        return sponge_geometry.lattice_bounds(radius, height)
+
 
-        data = self.make_rotund_cylinder()
+    def make_sponge(self, name, job):
+        """ Make a sponge, displacing it one vertex at a time with mathutils.noise """
+
+        data = self.make_rotund_cylinder(job)
         texturing_scheme = self.sea_sponge_props.texturing_scheme
-        
-        bump_reducer = 1.0 if texturing_scheme == 'SMOOTH' else utils.get_bump_reducer(self.sea_sponge_props.bump_scale)
+        bump_reducer = job['bump_reducer']
 
         for index, vert in enumerate(data["verts"]):
             # Construct mathutils.Vector
@@ -125,15 +267,80 @@ class GenSeaSponge(Operator):
             data["verts"][index] = (new_x, new_y, vert[2])
                 
         scene = bpy.context.scene
-        obj = utils.object_from_data(data, name, scene)
+        obj = utils.object_from_data(data, name, scene, pool=SPONGE_POOL)
         
         return obj
     
 
-    def rotate_sponge(self, obj):
-        obj.rotation_euler[0] = radians(random.randrange(-self.sea_sponge_props.x_rot, self.sea_sponge_props.x_rot))
-        obj.rotation_euler[1] = radians(random.randrange(-self.sea_sponge_props.y_rot, self.sea_sponge_props.y_rot))
-        obj.rotation_euler[2] = radians(random.randrange(self.sea_sponge_props.z_rot))
+    def link_sponge(self, name, job, geometry):
+        """ Link a sponge built by sponge_geometry.build_sponge into the scene """
+        topology = sponge_geometry.sponge_topology(job['resolution'], geometry['v_steps'])
+        data = {
+            'verts': geometry['verts'],
+            'edges': [],
+            'faces': topology['faces'],
+            'loops': topology['loops'],
+            'loop_start': topology['loop_start'],
+            'loop_total': topology['loop_total']
+        }
+        scene = bpy.context.scene
+        return utils.object_from_data(data, name, scene, pool=SPONGE_POOL)
+
+
+    def build_geometries(self, jobs):
+        """ Geometry for every job, farmed out to worker processes in parallel mode.
+            With the geometry cache on, cached jobs are loaded instead of built.
+            Streamed sponges are not memoized, placing them takes their arrays over
+        """
+        use_cache = self.sea_sponge_props.use_geometry_cache
+        # sponges built earlier in this session are reused straight from memory
+        geometries = [sponge_geometry.memoized('sponge', job) for job in jobs]
+        for index, job in enumerate(jobs):
+            if geometries[index] is None and use_cache:
+                geometries[index] = geometry_cache.load(job)
+                if geometries[index] is not None and not sponge_geometry.is_streamed(job):
+                    sponge_geometry.memoize('sponge', job, geometries[index])
+        missing = [index for index, geometry in enumerate(geometries) if geometry is None]
+        missing_jobs = [jobs[index] for index in missing]
+
+        if self.sea_sponge_props.parallel and len(missing_jobs) > 1:
+            num_workers = self.sea_sponge_props.num_workers
+            executor = get_pool(num_workers)
+            chunksize = max(1, len(missing_jobs) // (4 * (num_workers or os.cpu_count() or 1)))
+            built = list(executor.map(sponge_geometry.build_sponge, missing_jobs, chunksize=chunksize))
+        else:
+            built = [sponge_geometry.build_sponge(job) for job in missing_jobs]
+
+        for index, geometry in zip(missing, built):
+            geometries[index] = geometry
+            # worker processes memoize in their own memory, so remember their results here too
+            if not sponge_geometry.is_streamed(jobs[index]):
+                sponge_geometry.memoize('sponge', jobs[index], geometry)
+        if use_cache:
+            # sponges remembered from before the cache was turned on are saved as well
+            for job, geometry in zip(jobs, geometries):
+                geometry_cache.store(job, geometry)
+            geometry_cache.evict(self.sea_sponge_props.geometry_cache_size * 2**20)
+        return geometries
+
+
+    def sponge_random(self, x):
+        """ Random generator of sponge x. Each sponge has its own, so the global random
+            module other generators draw from is left alone
+        """
+        return random.Random(f"{self.seed}:{x}")
+
+
+    def get_sponge_rotation(self, rng):
+        return (radians(rng.randrange(-self.sea_sponge_props.x_rot, self.sea_sponge_props.x_rot)),
+            radians(rng.randrange(-self.sea_sponge_props.y_rot, self.sea_sponge_props.y_rot)),
+            radians(rng.randrange(self.sea_sponge_props.z_rot)))
+
+
+    def rotate_sponge(self, obj, rotation):
+        obj.rotation_euler[0] = rotation[0]
+        obj.rotation_euler[1] = rotation[1]
+        obj.rotation_euler[2] = rotation[2]
         
         
     def get_color_from_dist(self, dist, z):
@@ -168,177 +375,267 @@ class GenSeaSponge(Operator):
         return (red_scalar, green_scalar, blue_scalar, 1)
         
         
-    def color_faces_matte(self, obj):
-        mesh = bpy.context.object.data
-        
+    def shade_faces_matte(self, num_faces):
         r = self.sea_sponge_props.red_channel
         g = self.sea_sponge_props.green_channel
         b = self.sea_sponge_props.blue_channel
         
-        color = bpy.data.materials.new(f"color")
-        color.diffuse_color = (r, g, b, 1)
-        mesh.materials.append(color)
-        print(mesh.materials[0])
-            
-        # Create the mesh
-        # Adapted from this video https://www.youtube.com/watch?v=Mwap1W-6o7k&t=329s
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
-        for bm_face in bm.faces:
-            bm_face.material_index = 0
-        bm.to_mesh(mesh)
-        
+        materials, material_index = palette.color_slots([(r, g, b, 1)], np.zeros(num_faces, dtype=np.int32))
+        return {'materials': materials, 'material_index': material_index}
         
-    def color_faces_by_dist(self, obj):
-        mesh = bpy.context.object.data
         
-        max_z = 0
-        grouped_by_z = {}
-        # Construct dictionary of faces' average vertices, keyed on z-value
-        for index, face in enumerate(obj.data.polygons):
-            avg_vert = utils.find_face_mean_vert(obj, face, False)
-            # Save maximum z seen
-            if avg_vert.z > max_z:
-                max_z = avg_vert.z
-            if avg_vert.z in grouped_by_z:
-                grouped_by_z[avg_vert.z].append(avg_vert)
-            else:
-                grouped_by_z[avg_vert.z] = [avg_vert]
-        self.sea_sponge_props.max_z = max_z
-        
-        # Construct dictionary of local centers of vertices at each z level, keyed on z-value
-        z_centers = {}
-        for z in grouped_by_z:
-            n = len(grouped_by_z[z])
-            center = Vector((0, 0, 0))
-            for vert in grouped_by_z[z]:
-                center = center + vert
-            center = Vector((center.x / n, center.y / n, center.z /n))
-            z_centers[z] = center
-            
-        # Construct dictionary of min and max distances from centers at each z level, keyed on z-value
-        z_center_dist_max_mins = {}
-        for z in grouped_by_z:
-            max_dist = 0
-            min_dist = 1000000
-            for vert in grouped_by_z[z]:
-                dist = utils.get_distance_from_center(vert, z_centers[z])
-                if dist > max_dist:
-                    max_dist = dist
-                if dist < min_dist:
-                    min_dist = dist
-            z_center_dist_max_mins[z] = (min_dist, max_dist)
-            
-        # Construct a dictionary of colors, keyed on distance from relative center
-        face_color_dict = {}
-        mat_count = 0
-        for index, face in enumerate(obj.data.polygons):
-            avg_vert = utils.find_face_mean_vert(obj, face, False)
-            dist_to_center = utils.get_distance_from_center(avg_vert, z_centers[avg_vert.z])
-            mapped_dist = round(utils.map_range(dist_to_center, z_center_dist_max_mins[avg_vert.z][0], z_center_dist_max_mins[avg_vert.z][1], 0, 1.0), 2)
-            
-            if mapped_dist not in face_color_dict:
-                color = bpy.data.materials.new(f"color_{index}")
-                color.diffuse_color = self.get_color_from_dist(mapped_dist, avg_vert.z)
-                mesh.materials.append(color)
-                face_color_dict[mapped_dist] = mat_count
-                mat_count += 1
-
-        # Create the mesh
-        # Adapted from this video https://www.youtube.com/watch?v=Mwap1W-6o7k&t=329s
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
-        for bm_face in bm.faces:
-            avg_vert = utils.find_face_mean_vert(obj, bm_face, True)
-            dist_to_center =  utils.get_distance_from_center(avg_vert, z_centers[avg_vert.z])
-            bm_mapped_dist = round(utils.map_range(dist_to_center, z_center_dist_max_mins[avg_vert.z][0], z_center_dist_max_mins[avg_vert.z][1], 0, 1.0), 2)
-            bm_face.material_index = face_color_dict[bm_mapped_dist]
-        bm.to_mesh(mesh)
+    def shade_faces_by_dist(self, mapped_dists, max_z, dist_groups=None):
+        """ dist_groups optionally holds the distinct distances and each face's index
+            into them, when they are already known
+        """
+        if self.store_props:
+            self.sea_sponge_props.max_z = max_z
+
+        if self.sea_sponge_props.shading_output == 'ATTRIBUTE':
+            channels = (self.sea_sponge_props.red_channel,
+                self.sea_sponge_props.green_channel,
+                self.sea_sponge_props.blue_channel)
+            return {
+                'materials': [palette.get_ring_shader(self.sea_sponge_props.shading_scheme, channels)],
+                'material_index': np.zeros(len(mapped_dists), dtype=np.int32),
+                'attributes': {palette.RING_ATTRIBUTE: mapped_dists}
+            }
+
+        # One color per distinct distance, drawn from the shared palette
+        dists, color_indices = dist_groups or np.unique(mapped_dists, return_inverse=True)
+        colors = [self.get_color_from_dist(dist, max_z) for dist in dists]
+        materials, material_index = palette.color_slots(colors, color_indices)
+        return {'materials': materials, 'material_index': material_index}
     
     
-    def color_faces_glass(self, obj):
-        active_obj = bpy.context.active_object
-
-        # Create a new material
-        material = bpy.data.materials.new(name="Voronoi Shader")
-        material.use_nodes = True
-
-        # enable transparency
-        material.blend_method = 'BLEND'
-
-        material_output = material.node_tree.nodes.get('Material Output')
-        bsdf_node = material.node_tree.nodes.get('Principled BSDF')
-
-        # create smooth F1 voronoi shader node
-        smooth_f1_voronoi_node = material.node_tree.nodes.new('ShaderNodeTexVoronoi')
-        smooth_f1_voronoi_node.feature = 'SMOOTH_F1'
-        smooth_f1_voronoi_node.inputs['Scale'].default_value = self.sea_sponge_props.glass_cell_scale # larger values -> smaller cells
-        smooth_f1_voronoi_node.inputs['Smoothness'].default_value = self.sea_sponge_props.glass_cell_smoothness # smaller values -> thinner bones
-        # randomness (smaller -> square)
-
-        # create F1 voronoi shader node
-        f1_voronoi_node = material.node_tree.nodes.new('ShaderNodeTexVoronoi')
-        f1_voronoi_node.feature = 'F1'
-        f1_voronoi_node.inputs['Scale'].default_value = self.sea_sponge_props.glass_cell_scale # this should be in sync with smooth_f1
-        # randomness (smaller -> square)
-
-        subtract_node = material.node_tree.nodes.new('ShaderNodeMath')
-        subtract_node.operation = 'SUBTRACT'
-        material.node_tree.links.new(subtract_node.inputs[0], f1_voronoi_node.outputs['Distance'])
-        material.node_tree.links.new(subtract_node.inputs[1], smooth_f1_voronoi_node.outputs['Distance'])
-
-        less_than_node = material.node_tree.nodes.new('ShaderNodeMath')
-        less_than_node.operation = 'LESS_THAN'
-        less_than_node.inputs[1].default_value = 0.06 # threshold
-        material.node_tree.links.new(less_than_node.inputs[0], subtract_node.outputs[0])
-
-        # create comparison node
-        compare_node = material.node_tree.nodes.new('ShaderNodeMath')
-        compare_node.operation = 'COMPARE'
-        compare_node.inputs[1].default_value = 0.0 # value to compare against
-        compare_node.inputs[2].default_value = 0.3 # epsilon
-        material.node_tree.links.new(compare_node.inputs[0], less_than_node.outputs[0])
-
-        # link shaders to material
-        material.node_tree.links.new(bsdf_node.inputs['Base Color'], compare_node.outputs[0])
-        material.node_tree.links.new(bsdf_node.inputs['Alpha'], compare_node.outputs[0])
-        material.node_tree.links.new(material_output.inputs['Displacement'], f1_voronoi_node.outputs['Distance'])
-
-        # set active material to new material
-#        plane.active_material = material
-        active_obj.active_material = material
-
-    def color_faces(self, obj):
+    def shade_faces_glass(self, num_faces):
+        # the Voronoi material is built once per cell setting and shared by every glass sponge
+        material = palette.get_glass_material(
+            self.sea_sponge_props.glass_cell_scale,
+            self.sea_sponge_props.glass_cell_smoothness)
+        return {'materials': [material], 'material_index': np.zeros(num_faces, dtype=np.int32)}
+
+
+    def is_depth_shaded(self):
+        return (self.sea_sponge_props.species != 'GLASS'
+            and self.sea_sponge_props.shading_scheme != 'CUSTOM_MATTE')
+
+
+    def uses_mathutils_noise(self):
+        """ Whether sponges are displaced one vertex at a time by mathutils.noise.
+            Untextured sponges have no noise, so they always take the NumPy path
+        """
+        return (self.sea_sponge_props.noise_backend == 'MATHUTILS'
+            and sponge_geometry.is_textured(self.sea_sponge_props.species, self.sea_sponge_props.texturing_scheme))
+
+
+    def shade_faces(self, num_faces, mapped_dists=None, max_z=0.0, dist_groups=None):
+        """ Materials, per-face material slots and face attributes of a sponge,
+            as data that utils.set_face_data applies and mesh_merge can concatenate
+        """
         if self.sea_sponge_props.species == 'GLASS':
-            self.color_faces_glass(obj)
+            return self.shade_faces_glass(num_faces)
+        elif self.sea_sponge_props.shading_scheme == 'CUSTOM_MATTE':
+            return self.shade_faces_matte(num_faces)
+        return self.shade_faces_by_dist(mapped_dists, max_z, dist_groups)
+
+
+    def color_faces(self, obj, mapped_dists=None, max_z=0.0):
+        mesh = obj.data
+        if self.is_depth_shaded() and mapped_dists is None:
+            # The surface is a u x v grid, so faces come in rings of `resolution` faces
+            # sharing a z-value. All ring statistics are computed in one vectorized pass.
+            centers = np.empty(len(mesh.polygons) * 3, dtype=np.float32)
+            mesh.polygons.foreach_get('center', centers)
+            mapped_dists, max_z = surface.ring_distances(centers.reshape(-1, 3), self.sea_sponge_props.resolution)
+        utils.set_face_data(mesh, self.shade_faces(len(mesh.polygons), mapped_dists, max_z))
+
+
+    def merge_sponge_data(self, jobs, geometries):
+        """ Arrays of all sponges as one mesh: each sponge's rotation is applied to its
+            vertex array and the arrays are concatenated, so no per-sponge objects are made.
+            The merged geometry is memoized, so only shading is redone when just it changed
+        """
+        placement = sponge_geometry.place_sponges(jobs, geometries)
+        dist_groups = None
+        if 'dists' in placement:
+            dist_groups = (placement['dists'], placement['dist_index'])
+        shading = self.shade_faces(len(placement['loop_total']), placement.get('mapped_dists'),
+            placement.get('max_z', 0.0), dist_groups)
+        # the placement is shared with later runs, so add the shading to a copy
+        return dict(placement, **shading)
+
+
+    def merge_sponges(self, name, jobs, geometries):
+        """ Link all sponges into the scene as one object """
+        scene = bpy.context.scene
+        return utils.object_from_data(self.merge_sponge_data(jobs, geometries), name, scene, pool=SPONGE_POOL)
+
+
+    def make_sponges(self, jobs, names):
+        """ Create, color and rotate a sponge object for each job """
+        objs = []
+        if self.uses_mathutils_noise():
+            for name, job in zip(names, jobs):
+                # create, color, and rotate the sponge
+                obj = self.make_sponge(name, job)
+                self.color_faces(obj)
+                self.rotate_sponge(obj, job['rotation'])
+                objs.append(obj)
         else:
-            shading_scheme = self.sea_sponge_props.shading_scheme
-            if shading_scheme == 'CUSTOM_MATTE':
-                self.color_faces_matte(obj)
+            # geometry needs no bpy, so only linking and materials happen here
+            geometries = self.build_geometries(jobs)
+            for name, job, geometry in zip(names, jobs, geometries):
+                obj = self.link_sponge(name, job, geometry)
+                self.color_faces(obj, geometry['mapped_dists'], geometry['max_z'])
+                self.rotate_sponge(obj, job['rotation'])
+                objs.append(obj)
+        return objs
+
+
+    def instance_sponges(self, prototypes, jobs):
+        """ Place num_sponges sponges as linked duplicates or collection instances of the prototypes,
+            each with its own random rotation. Returns the instances and collections made
+        """
+        scene = bpy.context.scene
+        collections = []
+        instances = []
+        if self.sea_sponge_props.reef_mode == 'COLLECTION':
+            # move each prototype out of the scene into a collection of its own to be instanced
+            for index, prototype in enumerate(prototypes):
+                collection = utils.acquire_collection(SPONGE_POOL, f"sponge_prototype_{index}")
+                scene.collection.objects.unlink(prototype)
+                if prototype.name not in collection.objects:
+                    collection.objects.link(prototype)
+                prototype.rotation_euler = (0, 0, 0)
+                collections.append(collection)
+
+        for x in range(self.sea_sponge_props.num_sponges):
+            index = x % len(prototypes)
+            if x < len(jobs):
+                rotation = jobs[x]['rotation']
             else:
-                self.color_faces_by_dist(obj)
+                rotation = self.get_sponge_rotation(self.sponge_random(x))
+            if collections:
+                obj = utils.acquire_object(SPONGE_POOL, f"sponge_{x}", 'EMPTY')
+                obj.instance_type = 'COLLECTION'
+                obj.instance_collection = collections[index]
+            elif x < len(prototypes):
+                # the prototypes themselves are the first sponges
+                continue
+            else:
+                obj = utils.acquire_object(SPONGE_POOL, f"sponge_{x}", data=prototypes[index].data)
+            if obj.name not in scene.collection.objects:
+                scene.collection.objects.link(obj)
+            self.rotate_sponge(obj, rotation)
+            instances.append(obj)
+        return instances + collections
 
 
+class GenSeaSponge(SpongeBuilder, Operator):
+    bl_idname = 'sea.gen_sea_sponge'
+    bl_label = 'Generate Sea Sponge'
+    bl_options = {'REGISTER', "UNDO"}
+    
     def execute(self, context):
         self.sea_sponge_props = context.scene.sea_sponge_properties
+        # seed 0 asks for a new reef every time, from a seed drawn outside the global random
+        # module. It is kept in last_seed, so a reef that turned out well can be built again
+        self.seed = self.sea_sponge_props.seed or random.Random().randrange(1, 2**31)
+        self.sea_sponge_props.last_seed = self.seed
         
-        # create sponges
-        objs = []
-        for x in range(self.sea_sponge_props.num_sponges):
+        # Only prototypes are generated when instancing, the rest of the reef reuses them
+        num_sponges = self.sea_sponge_props.num_sponges
+        instancing = self.sea_sponge_props.reef_mode != 'UNIQUE'
+        num_unique = min(self.sea_sponge_props.num_prototypes, num_sponges) if instancing else num_sponges
+
+        # draw every sponge's random values up front, in the same order as building them one by one.
+        # Each sponge draws from its own seed, so a set seed and the same settings give the
+        # same reef on every redo, and changing one sponge's draws leaves the others alone
+        jobs = []
+        for x in range(num_unique):
+            rng = self.sponge_random(x)
             # set the radius based on props
-            self.sea_sponge_props.radius = random.uniform(self.sea_sponge_props.min_radius, self.sea_sponge_props.max_radius)
-            # create, color, and rotate the sponge
-            obj = self.make_sponge(f"sponge_{x}")
-            self.color_faces(obj)
-            self.rotate_sponge(obj)
-            objs.append(obj)
-        
-        scene = bpy.context.scene
-        
-        # Connect all sponges into one object
-        ctx = bpy.context.copy()
-        ctx['active_object'] = objs[0]
-        ctx['selected_editable_objects'] = objs
-        bpy.ops.object.join(ctx)
+            self.sea_sponge_props.radius = rng.uniform(self.sea_sponge_props.min_radius, self.sea_sponge_props.max_radius)
+            jobs.append(self.get_sponge_job(rng))
+
+        # create sponges
+        if self.sea_sponge_props.reef_mode == 'COLLECTION':
+            names = [f"sponge_prototype_{x}" for x in range(num_unique)]
+        else:
+            names = [f"sponge_{x}" for x in range(num_unique)]
+        if not jobs:
+            utils.release_pool(SPONGE_POOL, set())
+            unlock_interface(context.scene)
+            return {'FINISHED'}
+
+        # Preview sponges are built at a low resolution and remember their full-resolution
+        # jobs, which the render handlers build and swap in when a render starts
+        preview = self.sea_sponge_props.preview and not self.uses_mathutils_noise()
+        full_jobs = jobs
+        if preview:
+            jobs = [dict(job, resolution=self.sea_sponge_props.preview_resolution) for job in jobs]
+
+        if instancing:
+            # instances stay separate objects so that their meshes remain shared
+            prototypes = self.make_sponges(jobs, names)
+            for prototype, job in zip(prototypes, full_jobs):
+                # the prototype's rotation is on the object rather than in its mesh
+                self.mark_preview(prototype, [dict(job, rotation=(0, 0, 0))] if preview else None)
+            kept = prototypes + self.instance_sponges(prototypes, jobs)
+        elif self.uses_mathutils_noise():
+            # Connect all sponges into one object
+            kept = [utils.join_objects(self.make_sponges(jobs, names))]
+        else:
+            obj = self.merge_sponges(names[0], jobs, self.build_geometries(jobs))
+            self.mark_preview(obj, full_jobs if preview else None)
+            kept = [obj]
+
+        # drop whatever an earlier Generate made that this one did not reuse
+        utils.release_pool(SPONGE_POOL, {datablock.name for datablock in kept})
+        if preview:
+            lock_interface(context.scene)
+        else:
+            unlock_interface(context.scene)
                 
         return {'FINISHED'}
+
+
+    def mark_preview(self, obj, full_jobs):
+        """ Store the full-resolution jobs of a preview sponge, or clear them from a reused one """
+        if full_jobs is not None:
+            obj[PREVIEW_JOBS] = repr(full_jobs)
+        elif PREVIEW_JOBS in obj:
+            del obj[PREVIEW_JOBS]
+
+
+class ClearSeaSpongeCache(Operator):
+    bl_idname = 'sea.clear_sea_sponge_cache'
+    bl_label = 'Clear Geometry Cache'
+
+    def execute(self, context):
+        geometry_cache.clear()
+        return {'FINISHED'}
+
+
+class BakeSeaSponge(Operator):
+    bl_idname = 'sea.bake_sea_sponge'
+    bl_label = 'Bake Full Resolution'
+    bl_options = {'REGISTER', "UNDO"}
+
+    def execute(self, context):
+        """ Permanently replace preview sponges with their full-resolution geometry """
+        swap_in_full_resolution(context.scene)
+        preview_meshes = set()
+        for obj in bpy.data.objects:
+            if PREVIEW_MESH in obj:
+                preview_meshes.add(obj[PREVIEW_MESH])
+                del obj[PREVIEW_MESH]
+            if PREVIEW_JOBS in obj:
+                del obj[PREVIEW_JOBS]
+        for name in preview_meshes:
+            mesh = bpy.data.meshes[name]
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        unlock_interface(context.scene)
+        return {'FINISHED'}
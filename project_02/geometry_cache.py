@@ -0,0 +1,95 @@
+import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+
+# Persistent cache of built sponge geometry. A sponge's job holds every setting and
+# random draw its geometry depends on, so a hash of the job together with the source of
+# the geometry code identifies the result of sponge_geometry.build_sponge exactly.
+# Each entry is a directory of .npy files that are memory-mapped back on a hit.
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'sea_sponge_cache', 'meshes')
+# bump to drop every entry when the stored layout changes
+CACHE_VERSION = 1
+# modules whose source is part of every key, so editing them invalidates the cache
+CODE_MODULES = ['surface.py', 'vector_noise.py', 'sponge_geometry.py']
+# job values that do not affect the geometry
+IGNORED_KEYS = ['rotation']
+
+
+@lru_cache(maxsize=1)
+def code_version():
+    """ Hash of the geometry modules' source """
+    digest = hashlib.sha1()
+    module_dir = os.path.dirname(os.path.realpath(__file__))
+    for name in CODE_MODULES:
+        with open(os.path.join(module_dir, name), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def cache_key(job):
+    values = sorted((name, value) for name, value in job.items() if name not in IGNORED_KEYS)
+    key = repr((CACHE_VERSION, code_version(), values))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def load(job):
+    """ Cached geometry for job, or None. Arrays are memory-mapped read-only """
+    path = os.path.join(CACHE_DIR, cache_key(job))
+    try:
+        verts = np.load(os.path.join(path, 'verts.npy'), mmap_mode='r')
+        max_z, v_steps = np.load(os.path.join(path, 'info.npy'))
+        mapped_dists = None
+        if os.path.exists(os.path.join(path, 'mapped_dists.npy')):
+            mapped_dists = np.load(os.path.join(path, 'mapped_dists.npy'), mmap_mode='r')
+        # mark as recently used for eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return {'verts': verts, 'mapped_dists': mapped_dists, 'max_z': float(max_z), 'v_steps': int(v_steps)}
+
+
+def store(job, geometry):
+    """ Save geometry built for job """
+    path = os.path.join(CACHE_DIR, cache_key(job))
+    if os.path.exists(path):
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=CACHE_DIR, suffix='.tmp')
+    np.save(os.path.join(tmp_path, 'verts.npy'), geometry['verts'])
+    np.save(os.path.join(tmp_path, 'info.npy'), np.array([geometry['max_z'], geometry['v_steps']]))
+    if geometry['mapped_dists'] is not None:
+        np.save(os.path.join(tmp_path, 'mapped_dists.npy'), geometry['mapped_dists'])
+    # publish atomically so a concurrent reader never sees a half-written entry
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process stored the same entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def entry_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def evict(max_bytes):
+    """ Remove least recently used entries until the cache holds at most max_bytes """
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_dir() and not entry.name.endswith('.tmp'):
+            entries.append((entry.stat().st_mtime, entry_size(entry.path), entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def clear():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,128 @@
+import numpy as np
+from math import cos, sin
+
+# Merging meshes as flat NumPy arrays instead of joining objects with bpy.ops.object.join.
+# A part is a dict of the arrays utils.mesh_from_arrays takes ('verts', 'loops',
+# 'loop_start', 'loop_total') plus optional per-part data:
+#     'matrix'         4x4 transform applied to the part's verts
+#     'materials'      list of materials, indexed by 'material_index' (P,)
+#     'use_smooth'     (P,) bools
+#     'uv'             (L,2) loop uvs
+#     'attributes'     dict of name -> (P,) float face attributes
+# No bpy is needed here, materials can be any hashable.
+
+# Vertices transformed at a time, bounding the float64 temporaries of large meshes
+TRANSFORM_CHUNK = 2**16
+
+
+def euler_matrix(rotation):
+    """ 3x3 matrix of an XYZ Euler rotation, as Blender applies rotation_euler """
+    cx, cy, cz = (cos(angle) for angle in rotation)
+    sx, sy, sz = (sin(angle) for angle in rotation)
+    rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+def transform_matrix(rotation=(0, 0, 0), location=(0, 0, 0), scale=(1, 1, 1)):
+    """ 4x4 matrix of an object transform, like Object.matrix_basis """
+    matrix = np.identity(4)
+    matrix[:3, :3] = euler_matrix(rotation) * np.asarray(scale, dtype=float)
+    matrix[:3, 3] = location
+    return matrix
+
+
+def transform_verts(verts, matrix, out=None):
+    """ Apply a 4x4 matrix to (N,3) verts, into out if given """
+    matrix = np.asarray(matrix, dtype=float)
+    if out is None:
+        out = np.empty((len(verts), 3))
+    # transform in chunks so that only one chunk is ever held in float64
+    for start in range(0, len(verts), TRANSFORM_CHUNK):
+        chunk = np.asarray(verts[start:start + TRANSFORM_CHUNK], dtype=float)
+        out[start:start + TRANSFORM_CHUNK] = chunk @ matrix[:3, :3].T + matrix[:3, 3]
+    return out
+
+
+def merge_meshes(parts):
+    """ Concatenate parts into the arrays of a single mesh.
+        Vertex indices are offset by the verts before each part, and each part's
+        material slots are remapped into one list without duplicates. Parts missing
+        optional data get defaults (slot 0, flat, zero uv, zero attribute values).
+        Every output array is allocated once at its final size and filled part by part
+    """
+    num_verts = sum(len(part['verts']) for part in parts)
+    num_loops = sum(len(part['loops']) for part in parts)
+    num_faces = sum(len(part['loop_total']) for part in parts)
+
+    attribute_names = []
+    for part in parts:
+        for name in part.get('attributes', {}):
+            if name not in attribute_names:
+                attribute_names.append(name)
+
+    verts = np.empty((num_verts, 3), dtype=np.float32)
+    loops = np.empty(num_loops, dtype=np.int32)
+    loop_total = np.empty(num_faces, dtype=np.int32)
+    material_index = np.zeros(num_faces, dtype=np.int32)
+    use_smooth = np.zeros(num_faces, dtype=bool)
+    has_uv = any('uv' in part for part in parts)
+    uv = np.zeros((num_loops, 2), dtype=np.float32) if has_uv else None
+    attributes = {name: np.zeros(num_faces, dtype=np.float32) for name in attribute_names}
+    materials = []
+    slots = {}
+
+    vert_offset = 0
+    loop_offset = 0
+    face_offset = 0
+    for part in parts:
+        vert_end = vert_offset + len(part['verts'])
+        loop_end = loop_offset + len(part['loops'])
+        face_end = face_offset + len(part['loop_total'])
+
+        if 'matrix' in part:
+            transform_verts(part['verts'], part['matrix'], out=verts[vert_offset:vert_end])
+        else:
+            verts[vert_offset:vert_end] = np.reshape(part['verts'], (-1, 3))
+        np.add(part['loops'], vert_offset, out=loops[loop_offset:loop_end], casting='unsafe')
+        loop_total[face_offset:face_end] = part['loop_total']
+
+        # map the part's own slots to slots of the merged mesh
+        part_slots = []
+        for material in part.get('materials', []):
+            if material not in slots:
+                slots[material] = len(materials)
+                materials.append(material)
+            part_slots.append(slots[material])
+        if part_slots:
+            part_index = np.asarray(part.get('material_index', np.zeros(face_end - face_offset, dtype=np.int32)))
+            material_index[face_offset:face_end] = np.asarray(part_slots, dtype=np.int32)[part_index]
+
+        if 'use_smooth' in part:
+            use_smooth[face_offset:face_end] = part['use_smooth']
+        if 'uv' in part:
+            uv[loop_offset:loop_end] = np.reshape(part['uv'], (-1, 2))
+        for name, values in part.get('attributes', {}).items():
+            attributes[name][face_offset:face_end] = values
+
+        vert_offset, loop_offset, face_offset = vert_end, loop_end, face_end
+
+    loop_start = np.zeros_like(loop_total)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+
+    merged = {
+        'verts': verts,
+        'edges': [],
+        'faces': [],
+        'loops': loops,
+        'loop_start': loop_start,
+        'loop_total': loop_total,
+        'materials': materials,
+        'material_index': material_index,
+        'use_smooth': use_smooth,
+        'attributes': attributes
+    }
+    if has_uv:
+        merged['uv'] = uv
+    return merged
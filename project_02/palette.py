@@ -0,0 +1,175 @@
+import bpy
+import numpy as np
+from collections import OrderedDict
+
+# Colors are rounded to this many steps per channel, so near-identical
+# colors share one material
+PALETTE_STEPS = 256
+PALETTE_PREFIX = 'sponge_palette'
+# Face attribute holding the normalized ring distance, and the single material reading it
+RING_ATTRIBUTE = 'ring_dist'
+RING_SHADER_NAME = 'sponge_ring_shader'
+# Number of glass materials (one per cell scale/smoothness pair) kept around
+GLASS_CACHE_SIZE = 8
+
+# Names of cached glass materials, least recently used first
+glass_materials = OrderedDict()
+
+
+def quantize_color(color):
+    return tuple(round(channel * PALETTE_STEPS) / PALETTE_STEPS for channel in color)
+
+
+def get_material(color):
+    """ Shared material for color from the palette, created on first use.
+        Materials are looked up by a name derived from the quantized color rather than
+        held in a Python dict, so the palette survives undo, redo and file reloads
+    """
+    rgba = quantize_color(color)
+    name = PALETTE_PREFIX + '_' + '_'.join(str(round(channel * PALETTE_STEPS)) for channel in rgba)
+    material = bpy.data.materials.get(name)
+    if material is None:
+        material = bpy.data.materials.new(name)
+        material.diffuse_color = rgba
+    return material
+
+
+def color_slots(colors, color_indices):
+    """ Material slots for faces colored colors[color_indices[face]], as a list of
+        palette materials and each face's slot. Colors that quantize to the same
+        material share one slot
+    """
+    slots = {}
+    materials = []
+    color_slots = np.empty(len(colors), dtype=np.int32)
+    for index, color in enumerate(colors):
+        material = get_material(color)
+        if material.name not in slots:
+            slots[material.name] = len(materials)
+            materials.append(material)
+        color_slots[index] = slots[material.name]
+    return materials, color_slots[color_indices]
+
+
+def build_ring_shader_nodes(material, shading_scheme, channels):
+    """ Rebuild the node tree mapping the ring distance attribute to a base color,
+        following the same rules as GenSeaSponge.get_color_from_dist
+    """
+    nodes = material.node_tree.nodes
+    links = material.node_tree.links
+    nodes.clear()
+
+    output = nodes.new('ShaderNodeOutputMaterial')
+    bsdf = nodes.new('ShaderNodeBsdfPrincipled')
+    links.new(output.inputs['Surface'], bsdf.outputs['BSDF'])
+    attribute = nodes.new('ShaderNodeAttribute')
+    attribute.attribute_name = RING_ATTRIBUTE
+    dist = attribute.outputs['Fac']
+    combine = nodes.new('ShaderNodeCombineRGB')
+    links.new(bsdf.inputs['Base Color'], combine.outputs['Image'])
+
+    def math_node(operation, *inputs):
+        node = nodes.new('ShaderNodeMath')
+        node.operation = operation
+        for index, value in enumerate(inputs):
+            if isinstance(value, float):
+                node.inputs[index].default_value = value
+            else:
+                links.new(node.inputs[index], value)
+        return node.outputs[0]
+
+    if shading_scheme == 'CUSTOM_DEPTH':
+        # channel + max_color * (1 - dist)
+        max_color = 0.12
+        scalars = [math_node('MULTIPLY_ADD', dist, -max_color, max_color + channel) for channel in channels]
+    else:
+        # RUGRATS: one channel is 1 in each distance band, the others dist / 5
+        fifth = math_node('MULTIPLY', dist, 0.2)
+        remainder = math_node('SUBTRACT', 1.0, fifth)
+        high = math_node('GREATER_THAN', dist, 0.75)
+        low = math_node('LESS_THAN', dist, 0.25)
+        middle = math_node('SUBTRACT', math_node('SUBTRACT', 1.0, low), high)
+        scalars = [math_node('MULTIPLY_ADD', band, remainder, fifth) for band in (low, high, middle)]
+
+    for index, scalar in enumerate(scalars):
+        links.new(combine.inputs[index], scalar)
+
+
+def get_ring_shader(shading_scheme, channels):
+    """ The one material that colors faces from their ring distance attribute.
+        Changing the scheme or channels only rebuilds its small node tree
+    """
+    material = bpy.data.materials.get(RING_SHADER_NAME)
+    if material is None:
+        material = bpy.data.materials.new(RING_SHADER_NAME)
+        material.use_nodes = True
+    key = repr((shading_scheme, tuple(channels)))
+    if material.get('shading_key') != key:
+        build_ring_shader_nodes(material, shading_scheme, channels)
+        material['shading_key'] = key
+    return material
+
+
+def build_glass_nodes(material, cell_scale, cell_smoothness):
+    """ Voronoi bone pattern of a glass sponge """
+    # enable transparency
+    material.blend_method = 'BLEND'
+
+    material_output = material.node_tree.nodes.get('Material Output')
+    bsdf_node = material.node_tree.nodes.get('Principled BSDF')
+
+    # create smooth F1 voronoi shader node
+    smooth_f1_voronoi_node = material.node_tree.nodes.new('ShaderNodeTexVoronoi')
+    smooth_f1_voronoi_node.feature = 'SMOOTH_F1'
+    smooth_f1_voronoi_node.inputs['Scale'].default_value = cell_scale # larger values -> smaller cells
+    smooth_f1_voronoi_node.inputs['Smoothness'].default_value = cell_smoothness # smaller values -> thinner bones
+    # randomness (smaller -> square)
+
+    # create F1 voronoi shader node
+    f1_voronoi_node = material.node_tree.nodes.new('ShaderNodeTexVoronoi')
+    f1_voronoi_node.feature = 'F1'
+    f1_voronoi_node.inputs['Scale'].default_value = cell_scale # this should be in sync with smooth_f1
+    # randomness (smaller -> square)
+
+    subtract_node = material.node_tree.nodes.new('ShaderNodeMath')
+    subtract_node.operation = 'SUBTRACT'
+    material.node_tree.links.new(subtract_node.inputs[0], f1_voronoi_node.outputs['Distance'])
+    material.node_tree.links.new(subtract_node.inputs[1], smooth_f1_voronoi_node.outputs['Distance'])
+
+    less_than_node = material.node_tree.nodes.new('ShaderNodeMath')
+    less_than_node.operation = 'LESS_THAN'
+    less_than_node.inputs[1].default_value = 0.06 # threshold
+    material.node_tree.links.new(less_than_node.inputs[0], subtract_node.outputs[0])
+
+    # create comparison node
+    compare_node = material.node_tree.nodes.new('ShaderNodeMath')
+    compare_node.operation = 'COMPARE'
+    compare_node.inputs[1].default_value = 0.0 # value to compare against
+    compare_node.inputs[2].default_value = 0.3 # epsilon
+    material.node_tree.links.new(compare_node.inputs[0], less_than_node.outputs[0])
+
+    # link shaders to material
+    material.node_tree.links.new(bsdf_node.inputs['Base Color'], compare_node.outputs[0])
+    material.node_tree.links.new(bsdf_node.inputs['Alpha'], compare_node.outputs[0])
+    material.node_tree.links.new(material_output.inputs['Displacement'], f1_voronoi_node.outputs['Distance'])
+
+
+def get_glass_material(cell_scale, cell_smoothness):
+    """ Shared glass material for a cell scale/smoothness pair, built on first use.
+        At most GLASS_CACHE_SIZE are kept; evicted ones are removed once nothing uses them
+    """
+    name = f"Voronoi Shader {cell_scale:.4f} {cell_smoothness:.4f}"
+    material = bpy.data.materials.get(name)
+    if material is None:
+        material = bpy.data.materials.new(name=name)
+        material.use_nodes = True
+        build_glass_nodes(material, cell_scale, cell_smoothness)
+
+    glass_materials[name] = True
+    glass_materials.move_to_end(name)
+    while len(glass_materials) > GLASS_CACHE_SIZE:
+        evicted, _ = glass_materials.popitem(last=False)
+        evicted_material = bpy.data.materials.get(evicted)
+        if evicted_material is not None and evicted_material.users == 0:
+            bpy.data.materials.remove(evicted_material)
+    return material
@@ -1,5 +1,7 @@
 import bpy
 
+from generator import LOCK_INTERFACE
+
 class SeaSpongePanel(bpy.types.Panel):
     bl_label = "Sea Sponge Panel"
     bl_idname = "OBJECT_PT_sea_sponge_panel"
@@ -15,6 +17,12 @@ class SeaSpongePanel(bpy.types.Panel):
         col.prop(sea_sponge_props, 'species')
         col.label(text='Geometry:')
         col.prop(sea_sponge_props, 'num_sponges')
+        col.prop(sea_sponge_props, 'seed')
+        if sea_sponge_props.seed == 0 and sea_sponge_props.last_seed:
+            col.label(text=f'Last seed: {sea_sponge_props.last_seed}')
+        col.prop(sea_sponge_props, 'reef_mode')
+        if sea_sponge_props.reef_mode != 'UNIQUE':
+            col.prop(sea_sponge_props, 'num_prototypes')
         col.prop(sea_sponge_props, 'min_radius')
         col.prop(sea_sponge_props, 'max_radius')
         col.prop(sea_sponge_props, 'rotundness')
@@ -25,10 +33,29 @@ class SeaSpongePanel(bpy.types.Panel):
         col.prop(sea_sponge_props, 'y_rot')
         col.prop(sea_sponge_props, 'z_rot')
         col.prop(sea_sponge_props, 'resolution')
+        col.prop(sea_sponge_props, 'preview')
+        if sea_sponge_props.preview:
+            col.prop(sea_sponge_props, 'preview_resolution')
+        col.prop(sea_sponge_props, 'adaptive_rings')
+        if sea_sponge_props.adaptive_rings:
+            col.prop(sea_sponge_props, 'ring_tolerance')
+        col.prop(sea_sponge_props, 'parallel')
+        if sea_sponge_props.parallel:
+            col.prop(sea_sponge_props, 'num_workers')
+        col.prop(sea_sponge_props, 'use_geometry_cache')
+        if sea_sponge_props.use_geometry_cache:
+            col.prop(sea_sponge_props, 'geometry_cache_size')
         if sea_sponge_props.species in ['TUBE','GROSS']:
             col.label(text='Texturing:')
             col.prop(sea_sponge_props, 'texturing_scheme')
             col.prop(sea_sponge_props, 'bump_scale')
+            if sea_sponge_props.texturing_scheme != 'NONE':
+                col.prop(sea_sponge_props, 'noise_backend')
+            if (sea_sponge_props.noise_backend == 'NUMPY'
+                    and sea_sponge_props.texturing_scheme in ['TURBULENCE', 'STUCCO']):
+                col.prop(sea_sponge_props, 'use_noise_lattice')
+                if sea_sponge_props.use_noise_lattice:
+                    col.prop(sea_sponge_props, 'noise_lattice_resolution')
             if sea_sponge_props.texturing_scheme == 'TURBULENCE':
                 col.prop(sea_sponge_props, 'turbulence_octaves')
                 col.prop(sea_sponge_props, 'turbulence_amplitude')
@@ -37,10 +64,13 @@ class SeaSpongePanel(bpy.types.Panel):
                 col.prop(sea_sponge_props, 'turbulence_octaves')
                 col.prop(sea_sponge_props, 'turbulence_amplitude')
                 col.prop(sea_sponge_props, 'turbulence_frequency')
-                col.prop(sea_sponge_props, 'dnoise_dist')
+                if sea_sponge_props.noise_backend == 'MATHUTILS':
+                    col.prop(sea_sponge_props, 'dnoise_dist')
                 
             col.label(text='Custom Shading:')
             col.prop(sea_sponge_props, 'shading_scheme')
+            if sea_sponge_props.shading_scheme in ['CUSTOM_DEPTH', 'RUGRATS']:
+                col.prop(sea_sponge_props, 'shading_output')
             if 'CUSTOM' in sea_sponge_props.shading_scheme:
                 col.prop(sea_sponge_props, 'red_channel')
                 col.prop(sea_sponge_props, 'green_channel')
@@ -51,4 +81,15 @@ class SeaSpongePanel(bpy.types.Panel):
             col.label(text='Glass cell smoothness:')
             col.prop(sea_sponge_props, 'glass_cell_smoothness')
         row = layout.row()
-        row.operator('sea.gen_sea_sponge', text='Generate')
\ No newline at end of file
+        row.operator('sea.gen_sea_sponge', text='Generate')
+        if sea_sponge_props.preview:
+            row = layout.row()
+            row.operator('sea.bake_sea_sponge', text='Bake Full Resolution')
+        # preview sponges are only swapped for full-resolution ones while the interface is locked
+        if LOCK_INTERFACE in context.scene and not context.scene.render.use_lock_interface:
+            col = layout.column(align=True)
+            col.label(text='Renders will use preview sponges', icon='ERROR')
+            col.prop(context.scene.render, 'use_lock_interface')
+        if sea_sponge_props.use_geometry_cache:
+            row = layout.row()
+            row.operator('sea.clear_sea_sponge_cache', text='Clear Cache')
\ No newline at end of file
@@ -0,0 +1,11 @@
+import multiprocessing
+import sys
+
+
+def process_context():
+    """ Start method for worker processes, which only run the bpy-free modules.
+        Forking avoids re-running Blender's __main__ script in each worker, but is only
+        safe on Linux: on macOS the system frameworks Blender has loaded can crash a
+        forked child, which is why Python itself spawns there by default
+    """
+    return multiprocessing.get_context('fork' if sys.platform.startswith('linux') else 'spawn')
@@ -1,4 +1,4 @@
-from bpy.props import IntProperty, FloatProperty, EnumProperty
+from bpy.props import IntProperty, FloatProperty, EnumProperty, BoolProperty
 from bpy.types import PropertyGroup
 
 class SeaSpongeProperties(PropertyGroup):
@@ -75,6 +75,60 @@ class SeaSpongeProperties(PropertyGroup):
         min=0,
         max=1000
     )
+    seed: IntProperty(
+        name='Seed',
+        description='Seed of the random values; the same seed and settings give the same reef. '
+            '0 draws a new seed, and so a new reef, on every Generate',
+        default=0,
+        min=0
+    )
+    last_seed: IntProperty(
+        name='Last Seed',
+        description='Seed the last Generate used; set Seed to it to build that reef again',
+        default=0,
+        min=0
+    )
+    reef_mode: EnumProperty(
+        name='Reef Mode',
+        description='How the sponges of the reef are created',
+        items=[
+            ('UNIQUE', 'Unique Sponges', 'Generate every sponge and join them into one object'),
+            ('LINKED', 'Linked Duplicates', 'Generate a few prototypes and place the rest as linked duplicates'),
+            ('COLLECTION', 'Collection Instances', 'Generate a few prototypes and place every sponge as a collection instance')
+        ],
+        default='UNIQUE'
+    )
+    num_prototypes: IntProperty(
+        name='Prototypes',
+        description='Number of unique sponges generated when instancing',
+        default=10,
+        min=1,
+        max=1000
+    )
+    parallel: BoolProperty(
+        name='Parallel Generation',
+        description='Build sponge geometry in worker processes',
+        default=False
+    )
+    num_workers: IntProperty(
+        name='Workers',
+        description='Number of worker processes (0 for one per core)',
+        default=0,
+        min=0,
+        max=256
+    )
+    use_geometry_cache: BoolProperty(
+        name='Geometry Cache',
+        description='Keep built sponge geometry on disk and reuse it when the same sponge is generated again',
+        default=False
+    )
+    geometry_cache_size: IntProperty(
+        name='Cache Size (MB)',
+        description='Size the geometry cache is trimmed to, dropping least recently used sponges first',
+        default=1024,
+        min=1,
+        max=1000000
+    )
     shading_scheme: EnumProperty(
         name='Shading Scheme',
         description='Presets for shading schemes',
@@ -86,6 +140,15 @@ class SeaSpongeProperties(PropertyGroup):
         ],
         default='RUGRATS'
     )
+    shading_output: EnumProperty(
+        name='Shading Output',
+        description='How depth shading is stored on the sponges',
+        items=[
+            ('MATERIALS', 'Material Slots', 'One palette material per distinct color'),
+            ('ATTRIBUTE', 'Face Attribute', 'Ring distance face attribute read by a single node material')
+        ],
+        default='MATERIALS'
+    )
     texturing_scheme: EnumProperty(
         name='Texturing Scheme',
         description='Method for generating texture',
@@ -98,9 +161,31 @@ class SeaSpongeProperties(PropertyGroup):
         ],
         default='TURBULENCE'
     )
+    noise_backend: EnumProperty(
+        name='Noise Backend',
+        description='How the texturing noise is evaluated',
+        items=[
+            ('MATHUTILS', 'mathutils', "Evaluate Blender's noise one vertex at a time"),
+            ('NUMPY', 'NumPy', "Evaluate noise for all vertices at once. Much faster, but its noise "
+                "is not Blender's, so textured sponges look different")
+        ],
+        default='MATHUTILS'
+    )
+    use_noise_lattice: BoolProperty(
+        name='Baked Noise Lattice',
+        description='Bake turbulence once into a cached 3D grid and interpolate it for every sponge',
+        default=False
+    )
+    noise_lattice_resolution: IntProperty(
+        name='Lattice Resolution',
+        description='Number of samples along each axis of the baked noise lattice',
+        default=64,
+        min=8,
+        max=512
+    )
     dnoise_dist: FloatProperty(
         name='Dnoise Dist',
-        description='DNoise sampling dist',
+        description='DNoise sampling dist (mathutils backend only)',
         default=0.00001,
         min=0.0,
         max=1.0
@@ -161,6 +246,31 @@ class SeaSpongeProperties(PropertyGroup):
         min=10,
         max=1000
     )
+    preview: BoolProperty(
+        name='Preview',
+        description='Generate low resolution proxies that are swapped for full resolution sponges while rendering (NumPy backend only)',
+        default=False
+    )
+    preview_resolution: IntProperty(
+        name='Preview Resolution',
+        description='Resolution of preview sponges in the viewport',
+        default=10,
+        min=3,
+        max=1000
+    )
+    adaptive_rings: BoolProperty(
+        name='Adaptive Rings',
+        description='Place rings where the sponge profile bends instead of evenly, for fewer vertices. Only used for smooth and glass sponges, since noise textures need evenly spaced rings',
+        default=False
+    )
+    ring_tolerance: FloatProperty(
+        name='Ring Tolerance',
+        description='Largest distance the undisplaced profile may stray from the straight line between two rings',
+        default=0.002,
+        min=0.0001,
+        max=1.0,
+        precision=4
+    )
     radius: FloatProperty(
         name='Radius',
         description='Store radius',
@@ -11,7 +11,7 @@ if not dir in sys.path:
 # local modules
 from panel import SeaSpongePanel
 from properties import SeaSpongeProperties
-from generator import GenSeaSponge
+from generator import GenSeaSponge, BakeSeaSponge, ClearSeaSpongeCache, shutdown_pool, register_handlers, unregister_handlers
 
 from tank_panel import FishTankPanel
 from tank_properties import FishTankProperties
@@ -19,7 +19,7 @@ from tank_generator import GenFishTank
 
 # ---------------------------------------------------------
 
-CLASSES = [GenSeaSponge, SeaSpongeProperties, GenFishTank, FishTankProperties]
+CLASSES = [GenSeaSponge, BakeSeaSponge, ClearSeaSpongeCache, SeaSpongeProperties, GenFishTank, FishTankProperties]
 
 def register():
     for cls in CLASSES:
@@ -30,6 +30,7 @@ def register():
     
     bpy.utils.register_class(SeaSpongePanel)
     bpy.utils.register_class(FishTankPanel)
+    register_handlers()
 
 def unregister():
     for cls in CLASSES:
@@ -38,6 +39,8 @@ def unregister():
     del bpy.types.Scene.fish_tank_properties
     bpy.utils.unregister_class(SeaSpongePanel)
     bpy.utils.unregister_class(FishTankPanel)
+    unregister_handlers()
+    shutdown_pool()
 
     
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import math
+
+
+# SPATIAL GRID
+# ======================================================
+class SpatialGrid(object):
+    """ Uniform grid of cubes over the flock region, bucketing boids by position so that
+        a boid's neighbors are found among the 27 cells around it instead of the whole flock.
+        With cell_size equal to the perception radius, every boid within perception of a
+        point is in those cells. Positions outside the region are clamped into its border
+        cells, which keeps that true since clamping never moves two cells further apart
+    """
+    def __init__(self, cell_size, x_range, y_range, z_range):
+        # a zero radius perceives nothing, any positive cell size will do
+        self.cell_size = max(cell_size, 1e-6)
+        self.mins = (-x_range, -y_range, -z_range)
+        self.counts = tuple(max(1, math.ceil(2 * r / self.cell_size)) for r in (x_range, y_range, z_range))
+        self.cells = {}
+
+    def cell(self, position):
+        return tuple(
+            min(max(int((position[axis] - self.mins[axis]) // self.cell_size), 0), self.counts[axis] - 1)
+            for axis in range(3))
+
+    def build(self, boids):
+        """ Bucket every boid, once per frame """
+        self.cells = {}
+        for boid in boids:
+            self.insert(boid)
+
+    def insert(self, boid):
+        self.cells.setdefault(self.cell(boid.position), []).append(boid)
+
+    def neighbors(self, position):
+        """ Boids in the 27 cells around position, in flock order """
+        cx, cy, cz = self.cell(position)
+        found = []
+        for x in range(max(cx - 1, 0), min(cx + 2, self.counts[0])):
+            for y in range(max(cy - 1, 0), min(cy + 2, self.counts[1])):
+                for z in range(max(cz - 1, 0), min(cz + 2, self.counts[2])):
+                    found.extend(self.cells.get((x, y, z), ()))
+        # keep the order of the flock, so sums over neighbors match a full scan exactly
+        found.sort(key=lambda boid: boid.index)
+        return found
@@ -0,0 +1,349 @@
+import numpy as np
+from math import pi, log, floor, ceil
+from collections import OrderedDict
+
+# Sponge geometry that does not need bpy, so it can also run in worker processes.
+# A sponge is described by a job: a dict of plain values holding its random draws
+# and the settings its geometry reads (see GenSeaSponge.get_sponge_job).
+
+# local modules
+import surface
+import vector_noise
+import mesh_merge
+
+# Rotund cylinder equations. The per-sponge values are bound at call time
+# through params, so the compiled equations are shared by every sponge.
+ROTUND_X_EQ = "inner_r*cos(outer_r*v)*cos(u)"
+ROTUND_Y_EQ = "inner_r*cos(outer_r*v)*sin(u)"
+ROTUND_Z_EQ = "length*v*log((-v)+(v_span))+z_shift"
+
+RANGE_U_MIN = -pi
+RANGE_U_MAX = pi
+RANGE_V_MIN = -pi/2
+RANGE_V_MAX = pi/2
+
+# Adaptive ring placement picks rings from a grid this many times finer than the uniform one
+ADAPTIVE_OVERSAMPLING = 4
+
+# The pipeline runs in stages: surface -> displacement -> sponge (ring shading data) ->
+# placement. Each stage is memoized on the job values it reads, so regenerating after
+# changing a later stage's settings reuses the earlier stages' arrays.
+STAGE_KEYS = {
+    'surface': ('inner_r', 'outer_r', 'length', 'resolution', 'ring_tolerance'),
+    'displacement': ('inner_r', 'outer_r', 'length', 'resolution', 'ring_tolerance',
+        'species', 'texturing_scheme', 'octaves', 'amplitude_scale', 'frequency_scale',
+        'bump_reducer', 'lattice_resolution', 'lattice_bounds'),
+    'sponge': ('inner_r', 'outer_r', 'length', 'resolution', 'ring_tolerance',
+        'species', 'texturing_scheme', 'octaves', 'amplitude_scale', 'frequency_scale',
+        'bump_reducer', 'lattice_resolution', 'lattice_bounds', 'depth_shaded')
+}
+# Memory the memoized stage results may take up, least recently used are dropped first
+STAGE_MEMO_BYTES = 256 * 2**20
+# Sponges with more vertices than this are streamed: built a chunk of v-rings at a time
+# straight into their final float32 buffer, not memoized, and placed in that buffer
+STREAM_MIN_VERTS = 2**20
+# Vertices evaluated per chunk when streaming
+STREAM_CHUNK_VERTS = 2**16
+
+stage_memo = OrderedDict()
+stage_memo_bytes = 0
+# only the most recent placement is kept, since it holds the whole reef
+placement_memo = {}
+
+
+def sponge_topology(resolution, v_steps=None):
+    """ Shared face topology of a rotund cylinder: resolution u-steps by v_steps
+        v-steps (4*resolution unless adaptively sampled)
+    """
+    return surface.surface_topology(resolution, v_steps or 4 * resolution, True, False, False)
+
+
+def rotund_cylinder_v_values(inner_r, outer_r, length, resolution, tolerance):
+    """ v values of the rings of a rotund cylinder, placed by chord error instead of uniformly.
+        The z-profile is nearly straight over most of its range and bends only near the
+        ends, so rings are kept only where the (radius, z) profile between them would
+        stray more than tolerance from a straight chord. Returns None for uniform rings.
+        Only the undisplaced profile is looked at, so this is only for untextured sponges
+        (see is_textured): noise relief varies along v wherever the profile is straight,
+        and dropping those rings would smooth it away
+    """
+    if tolerance <= 0:
+        return None
+    v = np.linspace(RANGE_V_MIN, RANGE_V_MAX, 4 * resolution * ADAPTIVE_OVERSAMPLING + 1)
+    profile = np.stack([inner_r*np.cos(outer_r*v),
+        length*v*np.log(-v + 2*RANGE_V_MAX) + log(3*RANGE_V_MAX)*length*RANGE_V_MAX], axis=1)
+    return v[surface.simplify_polyline(profile, tolerance)]
+
+
+def rotund_cylinder_verts(inner_r, outer_r, length, resolution, v_values=None):
+    """ Vertices (N,3) of a rotund cylinder, with rings at v_values if given """
+    z_shift = log(3*RANGE_V_MAX)*length*RANGE_V_MAX
+    v_steps = 4 * resolution if v_values is None else len(v_values) - 1
+    params = {
+        'inner_r': inner_r,
+        'outer_r': outer_r,
+        'length': length,
+        'v_span': 2*RANGE_V_MAX,
+        'z_shift': z_shift
+    }
+    return surface.xyz_function_surface_verts(ROTUND_X_EQ, ROTUND_Y_EQ, ROTUND_Z_EQ,
+        RANGE_U_MIN, RANGE_U_MAX, resolution, True,
+        RANGE_V_MIN, RANGE_V_MAX, v_steps, False,
+        "0", "0", "0", "0", "0", "0", 1, params, v_values)
+
+
+def lattice_bounds(radius, height):
+    """ Box around every undisplaced vertex of sponges up to this radius and height,
+        rounded outwards so that small setting changes reuse the same baked lattice
+    """
+    # z profile of the rotund cylinder for a unit length
+    v = np.linspace(RANGE_V_MIN, RANGE_V_MAX, 1024)
+    z = v*np.log(-v + 2*RANGE_V_MAX) + log(3*RANGE_V_MAX)*RANGE_V_MAX
+    low = (-radius, -radius, height*min(z.min(), 0.0))
+    high = (radius, radius, height*max(z.max(), 0.0))
+    return (tuple(floor(x*2 - 1)/2 for x in low), tuple(ceil(x*2 + 1)/2 for x in high))
+
+
+def is_textured(species, texturing_scheme):
+    """ Whether get_bumps displaces vertices by noise rather than by a constant """
+    return species != 'GLASS' and texturing_scheme in ('PERLIN', 'TURBULENCE', 'STUCCO')
+
+
+def get_bumps(verts, job):
+    """ Bump vectors for all vertices at once, using the vectorized noise module """
+    texturing_scheme = job['texturing_scheme']
+    octaves = job['octaves']
+    amplitude_scale = job['amplitude_scale']
+    frequency_scale = job['frequency_scale']
+
+    if not is_textured(job['species'], texturing_scheme):
+        return np.ones((len(verts), 3))
+    elif texturing_scheme == 'PERLIN':
+        return vector_noise.noise_vector(verts)
+
+    if job['lattice_resolution']:
+        # look the turbulence up in the shared baked lattice
+        bounds = job['lattice_bounds']
+        lattice = vector_noise.turbulence_lattice(octaves, False, amplitude_scale, frequency_scale,
+            job['lattice_resolution'], bounds)
+        samples = vector_noise.sample_lattice(lattice, bounds, verts)
+        turbulence, dx, dy = samples[:, :3], samples[:, 3], samples[:, 4]
+    elif texturing_scheme == 'TURBULENCE':
+        return vector_noise.turbulence_vector(verts, octaves, False,
+            amplitude_scale=amplitude_scale, frequency_scale=frequency_scale)
+    else:
+        # the analytic gradient replaces the +h finite difference samples
+        turbulence, jacobian = vector_noise.turbulence_vector_gradient(verts, octaves, False,
+            amplitude_scale=amplitude_scale, frequency_scale=frequency_scale)
+        dx, dy = jacobian[:, 0, 0], jacobian[:, 1, 1]
+
+    if texturing_scheme == 'TURBULENCE':
+        return turbulence
+
+    dnoise = np.zeros((len(verts), 3))
+    dnoise[:, 0] = dx
+    dnoise[:, 1] = dy
+    # normalize, leaving zero vectors as they are like Vector.normalized()
+    length = np.linalg.norm(dnoise, axis=1, keepdims=True)
+    return np.divide(dnoise, length, out=np.zeros_like(dnoise), where=length > 0)
+
+
+def stage_key(stage, job):
+    return (stage,) + tuple(job[name] for name in STAGE_KEYS[stage])
+
+
+def array_bytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(array_bytes(item) for item in value.values())
+    return 0
+
+
+def memoized(stage, job):
+    """ The memoized result of stage for job, or None """
+    key = stage_key(stage, job)
+    if key not in stage_memo:
+        return None
+    stage_memo.move_to_end(key)
+    return stage_memo[key]
+
+
+def memoize(stage, job, value):
+    """ Remember value as the result of stage for job. Its arrays are made read-only
+        since every later caller shares them
+    """
+    global stage_memo_bytes
+    key = stage_key(stage, job)
+    if key in stage_memo or array_bytes(value) > STAGE_MEMO_BYTES:
+        return
+    for array in (value.values() if isinstance(value, dict) else [value]):
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+    stage_memo[key] = value
+    stage_memo_bytes += array_bytes(value)
+    while stage_memo_bytes > STAGE_MEMO_BYTES and len(stage_memo) > 1:
+        _, evicted = stage_memo.popitem(last=False)
+        stage_memo_bytes -= array_bytes(evicted)
+
+
+def surface_stage(job):
+    """ Undisplaced vertices and ring count of the sponge's rotund cylinder """
+    result = memoized('surface', job)
+    if result is None:
+        v_values = rotund_cylinder_v_values(job['inner_r'], job['outer_r'], job['length'],
+            job['resolution'], job['ring_tolerance'])
+        verts = rotund_cylinder_verts(job['inner_r'], job['outer_r'], job['length'], job['resolution'], v_values)
+        result = {'verts': verts, 'v_steps': len(verts) // job['resolution'] - 1}
+        memoize('surface', job, result)
+    return result
+
+
+def displacement_stage(job):
+    """ Vertices (N,3) float32 displaced by the sponge's noise """
+    verts = memoized('displacement', job)
+    if verts is None:
+        verts = surface_stage(job)['verts'].copy()
+        # Apply the bump factor and reducer to x and y only
+        verts[:, :2] += get_bumps(verts, job)[:, :2] / job['bump_reducer']
+        verts = verts.astype(np.float32)
+        memoize('displacement', job, verts)
+    return verts
+
+
+def is_streamed(job):
+    """ Whether the sponge is too large to build in one go, by its uniform vertex count """
+    return job['resolution'] * (4 * job['resolution'] + 1) > STREAM_MIN_VERTS
+
+
+def uniform_v_values(resolution):
+    """ v values of the uniform rings, as surface.xyz_function_surface_verts places them """
+    v_steps = 4 * resolution
+    return RANGE_V_MIN + np.arange(v_steps + 1) * ((RANGE_V_MAX - RANGE_V_MIN) / v_steps)
+
+
+def stream_sponge(job):
+    """ build_sponge for very large sponges. Rings are evaluated, displaced and shaded
+        STREAM_CHUNK_VERTS vertices at a time and written into preallocated arrays, so
+        peak memory stays close to the size of the result
+    """
+    resolution = job['resolution']
+    v_values = rotund_cylinder_v_values(job['inner_r'], job['outer_r'], job['length'],
+        resolution, job['ring_tolerance'])
+    if v_values is None:
+        v_values = uniform_v_values(resolution)
+    num_rings = len(v_values)
+    rings_per_chunk = max(1, STREAM_CHUNK_VERTS // resolution)
+
+    verts = np.empty((num_rings * resolution, 3), dtype=np.float32)
+    for start in range(0, num_rings, rings_per_chunk):
+        stop = min(start + rings_per_chunk, num_rings)
+        chunk = rotund_cylinder_verts(job['inner_r'], job['outer_r'], job['length'], resolution, v_values[start:stop])
+        # Apply the bump factor and reducer to x and y only
+        chunk[:, :2] += get_bumps(chunk, job)[:, :2] / job['bump_reducer']
+        verts[start * resolution:stop * resolution] = chunk
+
+    mapped_dists = None
+    max_z = 0.0
+    if job['depth_shaded']:
+        faces = sponge_topology(resolution, num_rings - 1)['faces']
+        mapped_dists = np.empty(len(faces))
+        # rings are shaded independently, so face rings can be chunked the same way
+        for start in range(0, len(faces), rings_per_chunk * resolution):
+            stop = min(start + rings_per_chunk * resolution, len(faces))
+            centers = verts[faces[start:stop]].mean(axis=1)
+            mapped_dists[start:stop], chunk_max_z = surface.ring_distances(centers, resolution)
+            max_z = max(max_z, chunk_max_z)
+    return {'verts': verts, 'mapped_dists': mapped_dists, 'max_z': max_z, 'v_steps': num_rings - 1}
+
+
+def build_sponge(job):
+    """ Surface evaluation, noise displacement and ring shading data for one sponge.
+        Returns compact arrays: 'verts' (N,3) float32, 'mapped_dists' (F,) per-face
+        ring distances (None if the sponge is not depth shaded), 'max_z' and 'v_steps'.
+        The face topology is not returned, since sponge_topology(resolution, v_steps) is shared
+    """
+    resolution = job['resolution']
+    if is_streamed(job):
+        return stream_sponge(job)
+
+    geometry = memoized('sponge', job)
+    if geometry is not None:
+        return geometry
+
+    v_steps = surface_stage(job)['v_steps']
+    verts = displacement_stage(job)
+
+    mapped_dists = None
+    max_z = 0.0
+    if job['depth_shaded']:
+        centers = verts[sponge_topology(resolution, v_steps)['faces']].mean(axis=1)
+        mapped_dists, max_z = surface.ring_distances(centers, resolution)
+    geometry = {'verts': verts, 'mapped_dists': mapped_dists, 'max_z': max_z, 'v_steps': v_steps}
+    memoize('sponge', job, geometry)
+    return geometry
+
+
+def place_streamed(job, geometry):
+    """ place_sponges for a single streamed sponge. Nothing else holds on to its arrays,
+        so its vertices are rotated where they are and its topology used as it is,
+        instead of merging into a second copy
+    """
+    topology = sponge_topology(job['resolution'], geometry['v_steps'])
+    verts = geometry['verts']
+    # arrays loaded from the geometry cache are read-only maps of the file
+    out = verts if verts.flags.writeable else np.empty(verts.shape, dtype=np.float32)
+    mesh_merge.transform_verts(verts, mesh_merge.transform_matrix(job['rotation']), out=out)
+    return {
+        'verts': out,
+        'edges': [],
+        'faces': [],
+        'loops': topology['loops'],
+        'loop_start': topology['loop_start'],
+        'loop_total': topology['loop_total']
+    }
+
+
+def place_sponges(jobs, geometries):
+    """ Placement stage: every sponge rotated by its job's rotation and merged into the
+        arrays of one mesh (see mesh_merge.merge_meshes), without materials.
+        For depth shaded sponges 'mapped_dists' holds the ring distance of every face,
+        'dists' its distinct values and 'dist_index' each face's index into them.
+        A single streamed sponge is placed in its own arrays, which it takes over
+    """
+    key = tuple((stage_key('sponge', job), job['rotation']) for job in jobs)
+    if placement_memo.get('key') == key:
+        return placement_memo['placement']
+
+    if len(jobs) == 1 and is_streamed(jobs[0]):
+        placement = place_streamed(jobs[0], geometries[0])
+    else:
+        placement = merge_placement(jobs, geometries)
+
+    if geometries and all(geometry['mapped_dists'] is not None for geometry in geometries):
+        placement['mapped_dists'] = np.concatenate([geometry['mapped_dists'] for geometry in geometries])
+        placement['dists'], placement['dist_index'] = np.unique(placement['mapped_dists'], return_inverse=True)
+        placement['max_z'] = max(geometry['max_z'] for geometry in geometries)
+    placement_memo.clear()
+    # a reef too large to build in one go is not worth holding on to a second copy of
+    if len(placement['verts']) <= STREAM_MIN_VERTS:
+        placement_memo['key'] = key
+        placement_memo['placement'] = placement
+    return placement
+
+
+def merge_placement(jobs, geometries):
+    """ Every sponge rotated and merged into the arrays of one mesh, without materials """
+    parts = []
+    for job, geometry in zip(jobs, geometries):
+        topology = sponge_topology(job['resolution'], geometry['v_steps'])
+        parts.append({
+            'verts': geometry['verts'],
+            'loops': topology['loops'],
+            'loop_start': topology['loop_start'],
+            'loop_total': topology['loop_total'],
+            'matrix': mesh_merge.transform_matrix(job['rotation'])
+        })
+    placement = mesh_merge.merge_meshes(parts)
+    del placement['materials'], placement['material_index'], placement['attributes']
+    return placement
@@ -0,0 +1,235 @@
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+
+# Memory the face topologies of recent resolutions may take up, least recently used are
+# dropped first. Adaptive ring sampling gives sponges differing ring counts, and a
+# topology's size grows with its resolution, so the cache is bounded by bytes
+TOPOLOGY_CACHE_BYTES = 64 * 2**20
+# Number of distinct equation sources whose compiled form is kept around
+EXPRESSION_CACHE_SIZE = 64
+
+# NumPy counterparts of the functions in utils.safe_list, so that the surface
+# equations can be evaluated over a whole u x v grid in one call
+np_safe_dict = {
+    'acos': np.arccos, 'asin': np.arcsin, 'atan': np.arctan, 'atan2': np.arctan2,
+    'ceil': np.ceil, 'cos': np.cos, 'cosh': np.cosh, 'degrees': np.degrees,
+    'e': np.e, 'exp': np.exp, 'fabs': np.fabs, 'floor': np.floor,
+    'fmod': np.fmod, 'frexp': np.frexp, 'hypot': np.hypot, 'ldexp': np.ldexp,
+    'log': np.log, 'log10': np.log10, 'modf': np.modf, 'pi': np.pi,
+    'pow': np.power, 'radians': np.radians, 'sin': np.sin, 'sinh': np.sinh,
+    'sqrt': np.sqrt, 'tan': np.tan, 'tanh': np.tanh
+}
+
+topology_cache = OrderedDict()
+topology_cache_bytes = 0
+
+
+def expression_names(code):
+    """ Names read by a compiled expression, including inside nested lambdas/comprehensions """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= expression_names(const)
+    return names
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(eq, name):
+    """ Compile one surface equation once, returning its code object and the names it reads """
+    code = compile(eq, __file__.replace(".py", f"_{name}.py"), 'eval')
+    return code, frozenset(expression_names(code))
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_surface_function(x_eq, y_eq, z_eq, a_eq, b_eq, c_eq, f_eq, g_eq, h_eq):
+    """ Compile the surface equations once into a function of NumPy u, v arrays.
+        The returned function takes (u, v, n, params) and returns an (N,3) float array.
+        Values that differ per sponge should be passed in params rather than formatted
+        into the equations, so that every sponge shares one compiled function
+    """
+    xyz_code = [compile_expression(eq, name)
+        for name, eq in (('x', x_eq), ('y', y_eq), ('z', z_eq))]
+
+    # a, b, c are evaluated before f, g, h so the latter can refer to them.
+    # Walk them backwards to find which ones x, y, z actually depend on.
+    helper_eqs = (('a', a_eq), ('b', b_eq), ('c', c_eq), ('f', f_eq), ('g', g_eq), ('h', h_eq))
+    needed = set().union(*(names for code, names in xyz_code))
+    helper_code = []
+    for name, eq in reversed(helper_eqs):
+        if name in needed:
+            code, names = compile_expression(eq, name)
+            needed |= names
+            helper_code.insert(0, (name, code))
+
+    def surface(u, v, n, params=None):
+        namespace = dict(np_safe_dict, u=u, v=v, n=n)
+        if params:
+            namespace.update(params)
+        for name, code in helper_code:
+            namespace[name] = np.asarray(eval(code, {"__builtins__": None}, namespace), dtype=float)
+
+        verts = np.empty((u.size, 3))
+        for axis, (code, names) in enumerate(xyz_code):
+            # constant equations evaluate to scalars and are broadcast here
+            verts[:, axis] = np.ravel(np.broadcast_to(eval(code, {"__builtins__": None}, namespace), u.shape))
+        return verts
+
+    return surface
+
+
+def xyz_function_surface_verts(x_eq, y_eq, z_eq,
+    range_u_min, range_u_max, range_u_step, wrap_u,
+    range_v_min, range_v_max, range_v_step, wrap_v,
+    a_eq, b_eq, c_eq, f_eq, g_eq, h_eq, n, params=None, v_values=None):
+    """ Vectorized vertex evaluation for utils.xyz_function_surface_faces.
+        Returns an (N,3) float array in the same v-major order as the loop version
+        params maps extra names used by the equations to their values for this call
+        v_values optionally replaces the uniform v steps with explicit, increasing v values
+        (range_v_step + 1 of them, or range_v_step if wrap_v), e.g. from adaptive sampling
+    """
+    uStep = (range_u_max - range_u_min) / range_u_step
+
+    uRange = range_u_step if wrap_u else range_u_step + 1
+    vRange = range_v_step if wrap_v else range_v_step + 1
+
+    surface = compile_surface_function(x_eq, y_eq, z_eq, a_eq, b_eq, c_eq, f_eq, g_eq, h_eq)
+
+    u = range_u_min + np.arange(uRange) * uStep
+    if v_values is None:
+        vStep = (range_v_max - range_v_min) / range_v_step
+        v = range_v_min + np.arange(vRange) * vStep
+    else:
+        v = np.asarray(v_values, dtype=float)
+    # v is the outer loop and u the inner one, matching the row-major meshgrid
+    u_grid, v_grid = np.meshgrid(u, v)
+
+    # math.* raises on a domain error, so make NumPy do the same instead of returning nan
+    with np.errstate(divide='raise', invalid='raise'):
+        return surface(u_grid.ravel(), v_grid.ravel(), n, params)
+
+
+def surface_topology(range_u_step, range_v_step, wrap_u, wrap_v, close_v):
+    """ Face topology of a parametric surface, which only depends on its resolution.
+        Returns a dict of read-only int32 arrays shared by every caller:
+            faces (F,4) quads, tris (T,3) cap triangles,
+            loops, loop_start and loop_total for bulk mesh construction
+    """
+    global topology_cache_bytes
+    key = (range_u_step, range_v_step, wrap_u, wrap_v, close_v)
+    if key in topology_cache:
+        topology_cache.move_to_end(key)
+        return topology_cache[key]
+
+    topology = build_topology(*key)
+    size = sum(array.nbytes for array in topology.values())
+    # a topology larger than the whole cache would only push out every other one
+    if size <= TOPOLOGY_CACHE_BYTES:
+        topology_cache[key] = topology
+        topology_cache_bytes += size
+        while topology_cache_bytes > TOPOLOGY_CACHE_BYTES:
+            _, evicted = topology_cache.popitem(last=False)
+            topology_cache_bytes -= sum(array.nbytes for array in evicted.values())
+    return topology
+
+
+def build_topology(range_u_step, range_v_step, wrap_u, wrap_v, close_v):
+    """ surface_topology without the cache """
+    uRange = range_u_step if wrap_u else range_u_step + 1
+    vRange = range_v_step if wrap_v else range_v_step + 1
+
+    uN = np.arange(range_u_step, dtype=np.int32)
+    uNext = uN + 1
+    if wrap_u:
+        uNext[uNext >= uRange] = 0
+    vN = np.arange(range_v_step, dtype=np.int32)[:, None]
+    vNext = vN + 1
+    if wrap_v:
+        vNext[vNext >= vRange] = 0
+
+    faces = np.stack(np.broadcast_arrays(
+        (vNext * uRange) + uNext,
+        (vNext * uRange) + uN,
+        (vN * uRange) + uN,
+        (vN * uRange) + uNext), axis=-1).reshape(-1, 4).astype(np.int32)
+
+    if close_v and wrap_u and (not wrap_v):
+        uN = np.arange(1, range_u_step - 1, dtype=np.int32)
+        bottom = np.stack([np.full_like(uN, range_u_step - 1),
+            range_u_step - 1 - uN,
+            range_u_step - 2 - uN], axis=-1)
+        top = np.stack([np.full_like(uN, range_v_step * uRange),
+            range_v_step * uRange + uN,
+            range_v_step * uRange + uN + 1], axis=-1)
+        # bottom and top triangles alternate, as in the loop version
+        tris = np.stack([bottom, top], axis=1).reshape(-1, 3).astype(np.int32)
+    else:
+        tris = np.empty((0, 3), dtype=np.int32)
+
+    loops = np.concatenate([faces.ravel(), tris.ravel()])
+    loop_total = np.concatenate([np.full(len(faces), 4, dtype=np.int32),
+        np.full(len(tris), 3, dtype=np.int32)])
+    loop_start = np.zeros_like(loop_total)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+
+    topology = {'faces': faces, 'tris': tris, 'loops': loops,
+        'loop_start': loop_start, 'loop_total': loop_total}
+    # the arrays are shared between sponges, so guard them against in-place edits
+    for array in topology.values():
+        array.flags.writeable = False
+    return topology
+
+
+def ring_distances(centers, ring_size):
+    """ Shading data for a surface whose faces come in rings of ring_size around z, in v order.
+        centers is the (F,3) array of face centers. Returns each face's distance from its
+        ring's center in the xy plane, mapped to 0-1 between the ring's min and max distance
+        and rounded to 2 places, together with the largest face-center z (at least 0)
+    """
+    centers = np.asarray(centers, dtype=float)
+    ring = np.arange(len(centers)) // ring_size
+    counts = np.bincount(ring)
+    ring_centers = np.stack([np.bincount(ring, weights=centers[:, axis]) for axis in range(3)], axis=1)
+    ring_centers /= counts[:, None]
+
+    offsets = centers[:, :2] - ring_centers[ring, :2]
+    dists = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+    ring_min = np.full(len(counts), np.inf)
+    ring_max = np.full(len(counts), -np.inf)
+    np.minimum.at(ring_min, ring, dists)
+    np.maximum.at(ring_max, ring, dists)
+
+    # a perfectly round ring has no spread, so map it to 0 instead of dividing by zero
+    span = (ring_max - ring_min)[ring]
+    mapped = np.divide(dists - ring_min[ring], span, out=np.zeros_like(dists), where=span > 0)
+    max_z = max(float(centers[:, 2].max()), 0.0) if len(centers) else 0.0
+    return np.round(mapped, 2), max_z
+
+
+def simplify_polyline(points, tolerance):
+    """ Indices of the points of an (N,2) polyline kept by Douglas-Peucker simplification:
+        every dropped point lies within tolerance of the chord between its kept neighbours.
+        The first and last points are always kept
+    """
+    points = np.asarray(points, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        chord = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        chord_length = np.hypot(chord[0], chord[1])
+        if chord_length > 0:
+            errors = np.abs(offsets[:, 0] * chord[1] - offsets[:, 1] * chord[0]) / chord_length
+        else:
+            errors = np.hypot(offsets[:, 0], offsets[:, 1])
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            split = start + 1 + worst
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
@@ -9,6 +9,12 @@ dir = os.path.dirname(bpy.data.filepath)
 if not dir in sys.path:
     sys.path.append(dir)
 
+# local modules
+import utils
+
+# Pool name marking the generated tank, see utils.acquire_object
+TANK_POOL = 'fish_tank'
+
 
 class GenFishTank(Operator):
     bl_idname = 'sea.gen_fish_tank'
@@ -102,14 +108,18 @@ class GenFishTank(Operator):
         scale = self.fish_tank_props.scale
         scale_x = scale_y = scale_z = scale
         
+        # The tank only depends on its scale, so an earlier tank is reused rather than imported again
+        tanks = [obj for obj in bpy.data.objects if obj.get(utils.POOL_PROPERTY) == TANK_POOL]
+        if tanks:
+            self.scale(tanks, scale_x, scale_y, scale_y)
+            return {'FINISHED'}
+        
         tank_objs = self.load_raw_objects()
         self.scale(tank_objs, scale_x, scale_y, scale_y)
 #        self.add_sand()
         
-        # Connect all sponges into one object
-        ctx = bpy.context.copy()
-        ctx['active_object'] = tank_objs[0]
-        ctx['selected_editable_objects'] = tank_objs
-        bpy.ops.object.join(ctx)
+        # Connect all tank parts into one object
+        tank = utils.join_objects(tank_objs)
+        tank[utils.POOL_PROPERTY] = TANK_POOL
                 
         return {'FINISHED'}
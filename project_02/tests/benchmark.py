@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+# Timings of the NumPy modules against what they replace, run as a script:
+#     python tests/benchmark.py
+# The noise comparison needs Blender's mathutils.noise, so it only runs where that
+# is importable, e.g. from Blender's Python console. Not collected by pytest.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vector_noise
+from flock_engine import FlockEngine
+
+
+def benchmark_noise(resolutions=(20, 100, 500), octaves=7, amplitude_scale=0.5, frequency_scale=0.5):
+    """ Compare per-vertex mathutils.noise against vector_noise on sponge-sized point sets """
+    try:
+        from mathutils import Vector, noise
+    except ImportError:
+        print("mathutils.noise is not available, skipping the noise benchmark")
+        return
+
+    rng = np.random.RandomState(0)
+    for res in resolutions:
+        # a sponge at this resolution has res u-steps and 4*res+1 v-rings
+        points = rng.uniform(-1.0, 1.0, size=((4 * res + 1) * res, 3))
+
+        start = time.perf_counter()
+        for point in points:
+            noise.turbulence_vector(Vector(point), octaves, False,
+                amplitude_scale=amplitude_scale, frequency_scale=frequency_scale)
+        mathutils_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector_noise.turbulence_vector(points, octaves, False,
+            amplitude_scale=amplitude_scale, frequency_scale=frequency_scale)
+        numpy_time = time.perf_counter() - start
+
+        print(f"resolution {res} ({len(points)} verts): mathutils {mathutils_time:.3f}s, "
+            f"numpy {numpy_time:.3f}s, speedup {mathutils_time / numpy_time:.1f}x")
+
+
+def benchmark_flock(sizes=(1000, 2000, 5000, 10000), frames=5):
+    """ Print the time per frame of the flock engine for flocks of each size,
+        at the panel's default settings in the default region
+    """
+    props = SimpleNamespace(
+        x_range=20, y_range=20, z_range=20, perception_radius=5, perception_angle=75,
+        alignment_strength=0.7, cohesion_strength=0.6, separation_strength=0.8,
+        max_velocity=2.0, max_acceleration=0.4, num_groups=3)
+    rng = np.random.RandomState(0)
+    for size in sizes:
+        ranges = np.array([props.x_range, props.y_range, props.z_range]) - 1
+        positions = rng.uniform(-ranges, ranges, size=(size, 3))
+        velocities = rng.uniform(-0.5, 0.5, size=(size, 3))
+        groups = rng.randint(0, props.num_groups, size=size)
+        engine = FlockEngine(positions, velocities, groups, props)
+        start = time.perf_counter()
+        for frame in range(frames):
+            engine.step()
+        print(f"{size} boids: {(time.perf_counter() - start) / frames:.3f}s per frame")
+
+
+if __name__ == '__main__':
+    benchmark_noise()
+    benchmark_flock()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests run outside Blender: the project's modules are imported from the directory
+# above, and the stubs directory stands in for bpy and mathutils, ahead of any
+# installed mathutils
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(TESTS_DIR, 'stubs'), os.path.dirname(TESTS_DIR)]
@@ -0,0 +1,55 @@
+import math
+import random
+from types import SimpleNamespace
+
+import mathutils
+from boid import Boid
+
+
+def flock_props(**settings):
+    """ Flock properties as the panel sets them by default, with a denser flock """
+    props = {
+        'num_boids': 60, 'num_groups': 2, 'x_range': 6, 'y_range': 6, 'z_range': 6,
+        'perception_radius': 3, 'perception_angle': 140,
+        'alignment_strength': 0.7, 'cohesion_strength': 0.6, 'separation_strength': 0.8,
+        'max_velocity': 0.4, 'max_acceleration': 0.05
+    }
+    props.update(settings)
+    return SimpleNamespace(**props)
+
+
+def random_state(flock_props, seed=0, num_boids=None):
+    """ Positions, velocities and groups drawn like Boid.__init__ draws them """
+    rng = random.Random(seed)
+    ranges = (flock_props.x_range, flock_props.y_range, flock_props.z_range)
+    positions, velocities, groups = [], [], []
+    for _ in range(flock_props.num_boids if num_boids is None else num_boids):
+        positions.append([rng.uniform(-r + 1, r - 1) for r in ranges])
+        velocities.append([rng.uniform(-0.5, 0.5) for _ in range(3)])
+        groups.append(rng.randint(0, flock_props.num_groups - 1))
+    return positions, velocities, groups
+
+
+def make_boids(flock_props, positions, velocities, groups):
+    """ Boids with the given state and no scene objects to avoid. Only the state flocking
+        uses is set, a full Boid would add objects to the scene
+    """
+    boids = []
+    for index in range(len(groups)):
+        boid = Boid.__new__(Boid)
+        boid.flock_props = flock_props
+        boid.position = mathutils.Vector(positions[index])
+        boid.velocity = mathutils.Vector(velocities[index])
+        boid.acceleration = mathutils.Vector((0, 0, 0))
+        boid.max_acceleration = flock_props.max_acceleration
+        boid.max_velocity = flock_props.max_velocity
+        boid.index = index
+        boid.perception_radius_sq = flock_props.perception_radius ** 2
+        boid.perception_cos = math.cos(math.radians(flock_props.perception_angle))
+        boid.group = groups[index]
+        boid.scene_objects = []
+        boid.obstacle_bounds = []
+        boid.projection_points = []
+        boid.avoidance_delay = 0
+        boids.append(boid)
+    return boids
@@ -0,0 +1 @@
+# Imported by the operator modules, which the tests call no bmesh functions of
@@ -0,0 +1,10 @@
+# The part of bpy the flock modules read when imported outside Blender:
+# the blend file's path, whose directory they put on sys.path, and the
+# bpy.props and bpy.types names the flock operator imports
+import os
+from types import SimpleNamespace
+
+from . import props, types
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+data = SimpleNamespace(filepath=os.path.join(PROJECT_DIR, 'sea_sponge.blend'))
@@ -0,0 +1,8 @@
+# Property definitions only annotate classes Blender registers, which the tests do not
+
+
+def property_stub(**settings):
+    return settings
+
+
+FloatProperty = IntProperty = PointerProperty = property_stub
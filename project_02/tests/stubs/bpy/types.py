@@ -0,0 +1,5 @@
+# Base class of the operators, so their methods can be called outside Blender
+
+
+class Operator(object):
+    pass
@@ -0,0 +1,58 @@
+import math
+
+# The part of mathutils.Vector boid.Boid flocks with, in double precision.
+# Blender's vectors are single precision, which the engine does not round to,
+# so the stub is also what lets a flock be compared with the engine bit for bit.
+
+
+class Vector(object):
+    def __init__(self, values):
+        self.values = [float(value) for value in values]
+
+    x = property(lambda self: self.values[0], lambda self, value: self.values.__setitem__(0, value))
+    y = property(lambda self: self.values[1], lambda self, value: self.values.__setitem__(1, value))
+    z = property(lambda self: self.values[2], lambda self, value: self.values.__setitem__(2, value))
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __add__(self, other):
+        return Vector([a + b for a, b in zip(self, other)])
+
+    def __sub__(self, other):
+        return Vector([a - b for a, b in zip(self, other)])
+
+    def __mul__(self, scale):
+        return Vector([a * scale for a in self])
+
+    def __iadd__(self, other):
+        self.values = (self + other).values
+        return self
+
+    def __isub__(self, other):
+        self.values = (self - other).values
+        return self
+
+    def __imul__(self, scale):
+        self.values = (self * scale).values
+        return self
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self, other))
+
+    @property
+    def length(self):
+        return math.sqrt(self.dot(self))
+
+    def normalized(self):
+        length = self.length
+        return self * (1 / length) if length else Vector(self)
+
+    def zero(self):
+        self.values = [0.0] * len(self.values)
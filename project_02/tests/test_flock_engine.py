@@ -0,0 +1,156 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import flock_engine
+import mesh_merge
+from flock_engine import FlockEngine, flock_settings, init_simulation, simulate
+from flock_obstacles import Obstacle, ObstacleMesh
+from flock_slabs import SlabFlock
+from processes import process_context
+from spatial_grid import SpatialGrid
+from flocks import flock_props, random_state, make_boids
+
+FRAMES = 20
+
+
+def positions_of(boids):
+    return np.array([list(boid.position) for boid in boids])
+
+
+def velocities_of(boids):
+    return np.array([list(boid.velocity) for boid in boids])
+
+
+def test_row_by_row_matches_sequential_boids():
+    """ Stepped one boid at a time, the engine flocks like the loop GenFlock.generate ran
+        before stepping was split in two: each boid flocks and moves before the next
+        one flocks, seeing the boids before it where they moved to
+    """
+    props = flock_props()
+    state = random_state(props, seed=1)
+    boids = make_boids(props, *state)
+    engine = FlockEngine(*state, props)
+
+    for frame in range(FRAMES):
+        for boid in boids:
+            boid.flock(boids)
+            boid.update()
+        for row in range(len(boids)):
+            engine.step(rows=np.array([row]))
+
+    assert np.allclose(engine.positions, positions_of(boids), rtol=0, atol=1e-9)
+    assert np.allclose(engine.velocities, velocities_of(boids), rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('wrap', [False, True])
+def test_step_matches_two_phase_boids(wrap):
+    """ A whole step flocks like GenFlock.generate: every boid flocks against the frame
+        before any of them moves
+    """
+    props = flock_props()
+    state = random_state(props, seed=2)
+    boids = make_boids(props, *state)
+    engine = FlockEngine(*state, props)
+    grid = SpatialGrid(props.perception_radius, props.x_range, props.y_range, props.z_range)
+
+    for frame in range(FRAMES):
+        grid.build(boids)
+        for boid in boids:
+            boid.flock(boids, grid)
+        for boid in boids:
+            boid.update()
+            if wrap:
+                boid.edges()
+        engine.step(wrap=wrap)
+
+    assert np.allclose(engine.positions, positions_of(boids), rtol=0, atol=1e-9)
+    assert np.allclose(engine.velocities, velocities_of(boids), rtol=0, atol=1e-9)
+
+
+def test_grid_neighbors_match_full_scan():
+    props = flock_props(num_boids=200, num_groups=1)
+    boids = make_boids(props, *random_state(props, seed=3))
+    grid = SpatialGrid(props.perception_radius, props.x_range, props.y_range, props.z_range)
+    grid.build(boids)
+    for boid in boids:
+        near = boid.perceive(boids, grid)
+        full = boid.perceive(boids)
+        assert near[0] == full[0]
+        assert [list(vector) for vector in near[1:]] == [list(vector) for vector in full[1:]]
+
+
+@pytest.mark.parametrize('num_workers', [1, 3])
+def test_slabs_match_single_engine(num_workers):
+    """ Stepping in slabs gives the same bits as one engine, whatever the number of workers """
+    props = flock_props(num_boids=300, num_groups=1)
+    state = random_state(props, seed=4)
+    engine = FlockEngine(*state, props)
+    flock = SlabFlock(*state, props, num_workers=num_workers, wrap=True)
+    try:
+        for frame in range(5):
+            engine.step(wrap=True)
+            flock.step()
+        assert np.array_equal(flock.positions, engine.positions)
+        assert np.array_equal(flock.velocities, engine.velocities)
+    finally:
+        flock.close()
+
+
+def cube_obstacles():
+    """ Unit cubes sharing one mesh about the flock's region, and projection points around it """
+    corners = np.array([(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    mesh = ObstacleMesh(corners[[[a, b, c] for a, b, c, d in quads] + [[a, c, d] for a, b, c, d in quads]])
+    obstacles = [Obstacle(mesh, mesh_merge.transform_matrix(location=location))
+        for location in [(0, 0, 0), (3, -2, 1), (-3, 3, -2)]]
+    points = np.random.RandomState(6).normal(size=(40, 3)) * 5
+    return obstacles, points
+
+
+def test_group_jobs_avoid_their_workers_obstacles():
+    """ simulate in a worker started by init_simulation avoids the obstacles like a local engine """
+    props = flock_props(num_boids=80)
+    state = random_state(props, seed=5)
+    obstacles, points = cube_obstacles()
+    engine = FlockEngine(*state, props)
+    avoided = False
+    for frame in range(5):
+        avoidance, avoiding = engine.avoidance(obstacles, points)
+        avoided |= avoiding.any()
+        engine.step(avoidance, avoiding)
+    assert avoided
+
+    job = {'positions': state[0], 'velocities': state[1], 'groups': state[2], 'avoidance_delay': 0,
+        'settings': flock_settings(props), 'frames': 5}
+    with ProcessPoolExecutor(max_workers=1, mp_context=process_context(),
+            initializer=init_simulation, initargs=(obstacles, points)) as executor:
+        trajectory = list(executor.map(simulate, [job]))[0]
+    assert np.array_equal(trajectory['positions'][-1], engine.positions)
+    assert np.array_equal(trajectory['velocities'][-1], engine.velocities)
+
+
+def test_flock_without_boids(monkeypatch):
+    """ A flock of no boids steps through obstacles in every mode without failing """
+    props = flock_props(num_boids=0)
+    state = random_state(props)
+    obstacles, points = cube_obstacles()
+    engine = FlockEngine(*state, props)
+    avoidance, avoiding = engine.avoidance(obstacles, points)
+    assert avoidance.shape == (0, 3) and avoiding.shape == (0,)
+    engine.step(avoidance, avoiding, wrap=True)
+
+    # as a worker would start, leaving this process's obstacles as they were afterwards
+    monkeypatch.setattr(flock_engine, 'worker_obstacles', flock_engine.worker_obstacles)
+    init_simulation(obstacles, points)
+    job = {'positions': state[0], 'velocities': state[1], 'groups': state[2], 'avoidance_delay': 0,
+        'settings': flock_settings(props), 'frames': 2}
+    assert simulate(job)['positions'].shape == (2, 0, 3)
+
+    flock = SlabFlock(*state, props, obstacles, points, num_workers=2, wrap=True)
+    try:
+        flock.step()
+        assert flock.positions.shape == (0, 3)
+    finally:
+        flock.close()
@@ -0,0 +1,75 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import mesh_merge
+import sponge_geometry
+from flock_obstacles import Obstacle, ObstacleMesh, ray_triangles
+
+
+def sponge_triangles(resolution=12):
+    """ Triangles of a turbulent sponge, as obstacle_mesh reads them from its mesh """
+    job = {
+        'inner_r': 1.0, 'outer_r': 0.8, 'length': 2.0, 'resolution': resolution, 'ring_tolerance': 0.0,
+        'species': 'TUBE', 'texturing_scheme': 'TURBULENCE', 'octaves': 3, 'amplitude_scale': 0.5,
+        'frequency_scale': 2.0, 'bump_reducer': 20.0, 'lattice_resolution': 0, 'lattice_bounds': None,
+        'depth_shaded': False, 'rotation': (0.2, 0.1, 0.3)
+    }
+    placement = sponge_geometry.place_sponges([job], [sponge_geometry.build_sponge(job)])
+    quads = placement['loops'].reshape(-1, 4)
+    faces = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    return placement['verts'].astype(float)[faces]
+
+
+def random_rays(rng, count, spread):
+    origins = rng.uniform(-spread, spread, size=(count, 3))
+    directions = rng.normal(size=(count, 3))
+    # some rays along the axes, which the box tests treat apart
+    directions[:count // 10] = np.eye(3)[rng.randint(0, 3, size=count // 10)] * rng.choice([-1, 1], size=(count // 10, 1))
+    return origins, directions / np.linalg.norm(directions, axis=1)[:, None]
+
+
+@pytest.mark.parametrize('triangles', ['soup', 'sponge'])
+def test_ray_cast_matches_every_triangle(triangles):
+    """ Walking the hierarchy finds the same hits as testing every triangle """
+    rng = np.random.RandomState(0)
+    if triangles == 'soup':
+        triangles = rng.uniform(-3, 3, size=(300, 1, 3)) + rng.normal(scale=0.5, size=(300, 3, 3))
+    else:
+        triangles = sponge_triangles()
+    obstacle = Obstacle(ObstacleMesh(triangles), mesh_merge.transform_matrix(location=(1, 2, 3)))
+    origins, directions = random_rays(rng, 2000, 4)
+
+    for distance in (0.5, 3.0):
+        hit, locations, normals = obstacle.ray_cast(origins, directions, distance)
+        expected = ray_triangles(origins, directions, obstacle.mesh.triangles, distance)
+        assert hit.any()
+        assert np.array_equal(hit, expected[0])
+        assert np.array_equal(locations, expected[1])
+        assert np.array_equal(normals, expected[2])
+        # stopping at any hit still tells which rays hit
+        assert np.array_equal(obstacle.ray_cast(origins, directions, distance, any_hit=True)[0], hit)
+
+
+def test_ray_cast_without_triangles():
+    origins, directions = random_rays(np.random.RandomState(1), 10, 1)
+    hit, locations, normals = Obstacle(ObstacleMesh(np.zeros((0, 3, 3))), np.identity(4)).ray_cast(origins, directions, 1.0)
+    assert not hit.any()
+    assert not locations.any() and not normals.any()
+
+
+def test_instances_share_their_mesh():
+    """ Obstacles of one mesh cast in their own space, and pickle sends the mesh once """
+    mesh = ObstacleMesh(sponge_triangles())
+    locations = [(0, 0, 0), (5, 0, 0), (0, -4, 2)]
+    obstacles = [Obstacle(mesh, mesh_merge.transform_matrix(location=location)) for location in locations]
+    origins, directions = random_rays(np.random.RandomState(2), 500, 3)
+    for obstacle, location in zip(obstacles, locations):
+        local = obstacle.to_local(origins + location)
+        assert np.allclose(local, origins)
+        assert np.array_equal(obstacle.ray_cast(local, directions, 2.0)[0], mesh.ray_cast(local, directions, 2.0)[0])
+
+    copies = pickle.loads(pickle.dumps(obstacles))
+    assert all(copy.mesh is copies[0].mesh for copy in copies)
+    assert len(pickle.dumps(obstacles)) < 1.1 * len(pickle.dumps(obstacles[:1]))
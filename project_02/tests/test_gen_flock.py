@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import pytest
+
+from gen_flock import GenFlock
+from flocks import flock_props
+
+
+@pytest.mark.parametrize('mode', ['generate_groups', 'generate_slabs', 'generate_vectorized'])
+def test_generate_without_boids(mode):
+    """ Every mode runs a flock of no boids through its frames, taking the obstacles
+        from what setup made rather than from the first boid
+    """
+    operator = GenFlock()
+    operator.flock_props = flock_props(num_boids=0, frames=3, num_workers=1)
+    operator.flock = []
+    operator.scene_objects = []
+    operator.projection_points = []
+    frames = []
+    context = SimpleNamespace(scene=SimpleNamespace(frame_set=frames.append))
+    getattr(operator, mode)(context)
+    assert frames == [0, 1, 2]
@@ -0,0 +1,62 @@
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import surface
+import utils
+from sponge_geometry import (ROTUND_X_EQ, ROTUND_Y_EQ, ROTUND_Z_EQ,
+    RANGE_U_MIN, RANGE_U_MAX, RANGE_V_MIN, RANGE_V_MAX)
+
+# a rotund cylinder's values, with an a..h helper the equations do not read
+PARAMS = {'inner_r': 1.2, 'outer_r': 0.8, 'length': 2.5, 'v_span': 3.0, 'z_shift': 0.4}
+HELPERS = ("0", "0", "0", "0", "0", "0")
+
+
+@pytest.mark.parametrize('wrap_u, wrap_v, close_v', list(itertools.product((False, True), repeat=3)))
+def test_numpy_surface_matches_loop(wrap_u, wrap_v, close_v):
+    """ The NumPy vertices and topology are the loop version's, in the same order """
+    u_steps, v_steps, n = 12, 9, 0
+    ranges = (RANGE_U_MIN, RANGE_U_MAX, u_steps, wrap_u, RANGE_V_MIN, RANGE_V_MAX, v_steps, wrap_v)
+
+    loop_verts, loop_faces = utils.xyz_function_surface_faces(
+        ROTUND_X_EQ, ROTUND_Y_EQ, ROTUND_Z_EQ, *ranges, *HELPERS, n, close_v, params=PARAMS)
+    verts = surface.xyz_function_surface_verts(
+        ROTUND_X_EQ, ROTUND_Y_EQ, ROTUND_Z_EQ, *ranges, *HELPERS, n, params=PARAMS)
+    topology = surface.surface_topology(u_steps, v_steps, wrap_u, wrap_v, close_v)
+
+    assert len(loop_verts) > 0
+    np.testing.assert_allclose(verts, loop_verts, rtol=1e-12, atol=1e-12)
+    faces = topology['faces'].tolist() + topology['tris'].tolist()
+    assert faces == [list(face) for face in loop_faces]
+
+
+def test_loop_leaves_safe_dict_alone():
+    """ Per-surface params do not leak into the names shared by later surfaces """
+    names = dict(utils.safe_dict)
+    utils.xyz_function_surface_faces(
+        ROTUND_X_EQ, ROTUND_Y_EQ, ROTUND_Z_EQ, RANGE_U_MIN, RANGE_U_MAX, 4, True,
+        RANGE_V_MIN, RANGE_V_MAX, 4, False, *HELPERS, 0, True, params=PARAMS)
+    assert utils.safe_dict == names
+
+
+def test_topology_cache_is_bounded_by_bytes(monkeypatch):
+    """ Least recently used topologies are dropped once the cache holds too many bytes,
+        and a topology larger than the whole cache is not kept at all
+    """
+    monkeypatch.setattr(surface, 'topology_cache', OrderedDict())
+    monkeypatch.setattr(surface, 'topology_cache_bytes', 0)
+    sizes = {steps: sum(array.nbytes for array in surface.build_topology(steps, steps, True, False, True).values())
+        for steps in (8, 9, 10, 64)}
+    monkeypatch.setattr(surface, 'TOPOLOGY_CACHE_BYTES', sizes[8] + sizes[9] + sizes[10] - 1)
+
+    first = surface.surface_topology(8, 8, True, False, True)
+    surface.surface_topology(9, 9, True, False, True)
+    assert surface.surface_topology(8, 8, True, False, True) is first
+    surface.surface_topology(10, 10, True, False, True)
+    assert list(surface.topology_cache) == [(8, 8, True, False, True), (10, 10, True, False, True)]
+    assert surface.topology_cache_bytes == sizes[8] + sizes[10]
+
+    surface.surface_topology(64, 64, True, False, True)
+    assert len(surface.topology_cache) == 2
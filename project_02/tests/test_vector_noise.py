@@ -0,0 +1,86 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import sponge_geometry
+import vector_noise
+
+NOISE = {'octaves': 3, 'amplitude_scale': 0.5, 'frequency_scale': 2.0}
+
+
+@pytest.fixture
+def lattice_dir(tmp_path, monkeypatch):
+    """ Bake lattices into a fresh directory, and forget them afterwards """
+    monkeypatch.setattr(vector_noise, 'LATTICE_DIR', str(tmp_path))
+    vector_noise.turbulence_lattice.cache_clear()
+    yield tmp_path
+    vector_noise.turbulence_lattice.cache_clear()
+
+
+@pytest.mark.parametrize('hard', [False, True])
+def test_gradient_matches_finite_difference(hard):
+    """ The analytic Jacobian is the central difference of turbulence_vector """
+    points = np.random.RandomState(0).uniform(-2.0, 2.0, size=(200, 3))
+    turbulence, jacobian = vector_noise.turbulence_vector_gradient(points, hard=hard, **NOISE)
+    np.testing.assert_array_equal(turbulence, vector_noise.turbulence_vector(points, hard=hard, **NOISE))
+
+    h = 1e-6
+    for axis in range(3):
+        step = np.zeros(3)
+        step[axis] = h
+        difference = (vector_noise.turbulence_vector(points + step, hard=hard, **NOISE)
+            - vector_noise.turbulence_vector(points - step, hard=hard, **NOISE)) / (2 * h)
+        np.testing.assert_allclose(jacobian[:, :, axis], difference, rtol=0, atol=1e-8)
+
+
+def test_lattice_holds_turbulence_at_its_nodes(lattice_dir):
+    """ Sampling the lattice at its nodes gives back the turbulence and STUCCO derivatives there """
+    resolution = 5
+    bounds = ((-1.0, -0.5, 0.0), (1.0, 1.5, 3.0))
+    lattice = vector_noise.turbulence_lattice(NOISE['octaves'], False, NOISE['amplitude_scale'],
+        NOISE['frequency_scale'], resolution, bounds)
+    assert lattice.shape == (resolution, resolution, resolution, 5)
+
+    axes = [np.linspace(bounds[0][axis], bounds[1][axis], resolution) for axis in range(3)]
+    nodes = np.array(list(itertools.product(*axes)))
+    turbulence, jacobian = vector_noise.turbulence_vector_gradient(nodes, hard=False, **NOISE)
+    expected = np.column_stack([turbulence, jacobian[:, 0, 0], jacobian[:, 1, 1]])
+    # the lattice is stored as float32
+    np.testing.assert_allclose(vector_noise.sample_lattice(lattice, bounds, nodes), expected, rtol=1e-5, atol=1e-6)
+
+    # a second bake of the same lattice is read back from its file
+    vector_noise.turbulence_lattice.cache_clear()
+    again = vector_noise.turbulence_lattice(NOISE['octaves'], False, NOISE['amplitude_scale'],
+        NOISE['frequency_scale'], resolution, bounds)
+    np.testing.assert_array_equal(again, lattice)
+    assert len(list(lattice_dir.iterdir())) == 1
+
+
+def test_lattice_interpolates_between_nodes(lattice_dir):
+    """ Halfway between two nodes along x, a sample is the mean of the two """
+    bounds = ((0.0, 0.0, 0.0), (1.0, 1.0, 1.0))
+    lattice = vector_noise.turbulence_lattice(2, False, 0.5, 2.0, 3, bounds)
+    sample = vector_noise.sample_lattice(lattice, bounds, [(0.25, 0.5, 1.0)])
+    np.testing.assert_allclose(sample[0], (lattice[0, 1, 2] + lattice[1, 1, 2]) / 2, rtol=1e-6)
+
+
+@pytest.mark.parametrize('texturing_scheme, ring_tolerance', [
+    ('TURBULENCE', 0.0), ('STUCCO', 0.0), ('NONE', 0.001)])
+def test_stream_sponge_matches_build_sponge(texturing_scheme, ring_tolerance, monkeypatch):
+    """ Streaming a sponge in chunks of a few rings builds the same sponge """
+    monkeypatch.setattr(sponge_geometry, 'STREAM_CHUNK_VERTS', 50)
+    job = {
+        'inner_r': 1.0, 'outer_r': 0.8, 'length': 2.0, 'resolution': 12, 'ring_tolerance': ring_tolerance,
+        'species': 'TUBE', 'texturing_scheme': texturing_scheme, 'octaves': 3, 'amplitude_scale': 0.5,
+        'frequency_scale': 2.0, 'bump_reducer': 20.0, 'lattice_resolution': 0,
+        'lattice_bounds': None, 'depth_shaded': True, 'rotation': (0.0, 0.0, 0.0)
+    }
+    assert not sponge_geometry.is_streamed(job)
+    built = sponge_geometry.build_sponge(job)
+    streamed = sponge_geometry.stream_sponge(job)
+
+    assert streamed['v_steps'] == built['v_steps']
+    np.testing.assert_array_equal(streamed['verts'], built['verts'])
+    np.testing.assert_allclose(streamed['mapped_dists'], built['mapped_dists'])
+    assert streamed['max_z'] == built['max_z']
@@ -1,12 +1,20 @@
 import bpy
+import numpy as np
 import random
 from math import *
 from mathutils import *
+
+# local modules
+import mesh_merge
+
+# Custom property naming the generator that owns an object or collection, so the
+# generator can reuse its datablocks when it runs again instead of leaving orphans
+POOL_PROPERTY = 'generator_pool'
     
-def get_bump_reducer(n):
+def get_bump_reducer(n, rng=random):
     min = (10-n)*10+5
     max = (10-n)*10+15
-    return random.uniform(min, max)
+    return rng.uniform(min, max)
 
 # Adapted from this code https://stackoverflow.com/questions/4154969/how-to-map-numbers-in-range-099-to-range-1-01-0/33127793
 def map_range(value, original_range_min, original_range_max, new_range_min, new_range_max):
@@ -45,14 +53,210 @@ def find_face_mean_vert(obj, face, is_bm):
     return avg_vert
 
 
-def object_from_data(data, name, scene, select=True):
-    mesh = bpy.data.meshes.new(name)
-    obj = bpy.data.objects.new(name, mesh)
-    scene.collection.objects.link(obj)
+def mesh_from_arrays(mesh, verts, loops, loop_start, loop_total):
+    """ Fill an empty mesh from flat NumPy arrays in bulk with foreach_set:
+        verts (N,3), loops (L,) vertex indices, loop_start and loop_total (P,)
+    """
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set('co', np.ascontiguousarray(verts, dtype=np.float32).ravel())
+
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set('vertex_index', np.ascontiguousarray(loops, dtype=np.int32))
+
+    mesh.polygons.add(len(loop_start))
+    mesh.polygons.foreach_set('loop_start', np.ascontiguousarray(loop_start, dtype=np.int32))
+    mesh.polygons.foreach_set('loop_total', np.ascontiguousarray(loop_total, dtype=np.int32))
+
+    mesh.update(calc_edges=True)
+
+
+def set_face_data(mesh, data):
+    """ Set the optional per-face data of a mesh_merge part on a filled mesh:
+        'materials' and 'material_index', 'use_smooth', 'uv' and float face 'attributes'
+    """
+    for material in data.get('materials', []):
+        mesh.materials.append(material)
+    if 'material_index' in data:
+        mesh.polygons.foreach_set('material_index', np.ascontiguousarray(data['material_index'], dtype=np.int32))
+    if 'use_smooth' in data:
+        mesh.polygons.foreach_set('use_smooth', np.ascontiguousarray(data['use_smooth'], dtype=bool))
+    if 'uv' in data:
+        uv_layer = mesh.uv_layers.new(name='UVMap')
+        uv_layer.data.foreach_set('uv', np.ascontiguousarray(data['uv'], dtype=np.float32).ravel())
+    for name, values in data.get('attributes', {}).items():
+        attribute = mesh.attributes.get(name)
+        if attribute is None:
+            attribute = mesh.attributes.new(name=name, type='FLOAT', domain='FACE')
+        attribute.data.foreach_set('value', np.ascontiguousarray(values, dtype=np.float32))
+
+
+def mesh_to_arrays(mesh):
+    """ Read a mesh back into a mesh_merge part with foreach_get, the inverse of
+        mesh_from_arrays and set_face_data
+    """
+    verts = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts)
+    loops = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loops)
+
+    num_faces = len(mesh.polygons)
+    loop_start = np.empty(num_faces, dtype=np.int32)
+    loop_total = np.empty(num_faces, dtype=np.int32)
+    material_index = np.empty(num_faces, dtype=np.int32)
+    use_smooth = np.empty(num_faces, dtype=bool)
+    mesh.polygons.foreach_get('loop_start', loop_start)
+    mesh.polygons.foreach_get('loop_total', loop_total)
+    mesh.polygons.foreach_get('material_index', material_index)
+    mesh.polygons.foreach_get('use_smooth', use_smooth)
+
+    # polygons are not guaranteed to store their loops in order, so gather them
+    packed_start = np.cumsum(loop_total) - loop_total
+    order = np.repeat(loop_start - packed_start, loop_total) + np.arange(len(loops))
+    data = {
+        'verts': verts.reshape(-1, 3),
+        'loops': loops[order],
+        'loop_start': packed_start.astype(np.int32),
+        'loop_total': loop_total,
+        'materials': list(mesh.materials),
+        'material_index': material_index,
+        'use_smooth': use_smooth,
+        'attributes': {}
+    }
+    if mesh.uv_layers.active is not None:
+        uv = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get('uv', uv)
+        data['uv'] = uv.reshape(-1, 2)[order]
+    for attribute in mesh.attributes:
+        if attribute.domain == 'FACE' and attribute.data_type == 'FLOAT':
+            values = np.empty(num_faces, dtype=np.float32)
+            attribute.data.foreach_get('value', values)
+            data['attributes'][attribute.name] = values
+    return data
+
+
+def join_objects(objs):
+    """ Join mesh objects into the first one, like bpy.ops.object.join without the
+        operator: every mesh is read with foreach_get, moved into the first object's
+        space in NumPy and written into the first object's mesh. The other objects are removed
+    """
+    # matrix_world is only refreshed by a view layer update after transforms change
+    bpy.context.view_layer.update()
+    target = objs[0]
+    to_target = np.linalg.inv(np.array(target.matrix_world))
+    parts = []
+    for obj in objs:
+        part = mesh_to_arrays(obj.data)
+        part['matrix'] = to_target @ np.array(obj.matrix_world)
+        parts.append(part)
+    merged = mesh_merge.merge_meshes(parts)
+
+    meshes = [obj.data for obj in objs[1:]]
+    for obj in objs[1:]:
+        bpy.data.objects.remove(obj)
+    for old_mesh in meshes:
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+
+    # the first object's mesh is rewritten in place unless something else shares it
+    if target.data.users == 1:
+        mesh = target.data
+        mesh.clear_geometry()
+        mesh.materials.clear()
+    else:
+        mesh = bpy.data.meshes.new(target.data.name)
+        target.data = mesh
+    mesh_from_arrays(mesh, merged['verts'], merged['loops'], merged['loop_start'], merged['loop_total'])
+    set_face_data(mesh, merged)
+    return target
+
+
+def remove_object(obj):
+    """ Remove obj, and its mesh if nothing else uses it """
+    data = obj.data
+    bpy.data.objects.remove(obj)
+    if isinstance(data, bpy.types.Mesh) and data.users == 0:
+        bpy.data.meshes.remove(data)
+
+
+def acquire_object(pool, name, object_type='MESH', data=None):
+    """ Object called name owned by pool, reused from an earlier run when it still exists.
+        It is given data if passed. Otherwise a mesh object gets an empty mesh: its own
+        mesh cleared in place with clear_geometry when no other object shares it, or a new one.
+        A reused object's transform is reset; linking it is up to the caller
+    """
+    obj = bpy.data.objects.get(name)
+    if obj is not None and obj.get(POOL_PROPERTY) == pool and obj.type != object_type:
+        # free the name for an object of the right type
+        remove_object(obj)
+        obj = None
+    if obj is None or obj.get(POOL_PROPERTY) != pool:
+        if data is None and object_type == 'MESH':
+            data = bpy.data.meshes.new(name)
+        obj = bpy.data.objects.new(name, data)
+        obj[POOL_PROPERTY] = pool
+        return obj
+
+    obj.location = (0, 0, 0)
+    obj.rotation_euler = (0, 0, 0)
+    obj.scale = (1, 1, 1)
+    if data is not None:
+        old_data = obj.data
+        obj.data = data
+        if old_data.users == 0:
+            bpy.data.meshes.remove(old_data)
+    elif object_type == 'MESH' and obj.data.users > 1:
+        obj.data = bpy.data.meshes.new(name)
+    elif object_type == 'MESH':
+        obj.data.clear_geometry()
+        obj.data.materials.clear()
+    return obj
+
+
+def acquire_collection(pool, name):
+    """ Collection called name owned by pool, reused from an earlier run when it still exists """
+    collection = bpy.data.collections.get(name)
+    if collection is None or collection.get(POOL_PROPERTY) != pool:
+        collection = bpy.data.collections.new(name)
+        collection[POOL_PROPERTY] = pool
+    return collection
+
+
+def release_pool(pool, keep):
+    """ Remove the objects and collections of pool whose names are not in keep,
+        along with the meshes this leaves without users
+    """
+    for obj in list(bpy.data.objects):
+        if obj.get(POOL_PROPERTY) == pool and obj.name not in keep:
+            remove_object(obj)
+    for collection in list(bpy.data.collections):
+        if collection.get(POOL_PROPERTY) == pool and collection.name not in keep:
+            bpy.data.collections.remove(collection)
+
+
+def object_from_data(data, name, scene, select=True, validate=False, pool=None):
+    """ Link an object built from data into the scene.
+        If data holds 'loops', 'loop_start' and 'loop_total' arrays the mesh is filled
+        in bulk, otherwise it goes through from_pydata with 'verts', 'edges' and 'faces'.
+        With pool, the object and its mesh from an earlier run are rewritten in place.
+        validate is a debugging aid: it re-scans the whole mesh and prints to the console
+    """
+    if pool is None:
+        mesh = bpy.data.meshes.new(name)
+        obj = bpy.data.objects.new(name, mesh)
+    else:
+        obj = acquire_object(pool, name)
+        mesh = obj.data
+    if obj.name not in scene.collection.objects:
+        scene.collection.objects.link(obj)
     bpy.context.view_layer.objects.active = obj
 
-    mesh.from_pydata(data['verts'], data['edges'], data['faces'])
-    mesh.validate(verbose=True)
+    if 'loops' in data:
+        mesh_from_arrays(mesh, data['verts'], data['loops'], data['loop_start'], data['loop_total'])
+        set_face_data(mesh, data)
+    else:
+        mesh.from_pydata(data['verts'], data['edges'], data['faces'])
+    if validate:
+        mesh.validate(verbose=True)
     
     mesh.update()
 
@@ -71,10 +275,13 @@ safe_dict = dict((k, globals().get(k, None)) for k in safe_list)
 def xyz_function_surface_faces(x_eq, y_eq, z_eq,
     range_u_min, range_u_max, range_u_step, wrap_u,
     range_v_min, range_v_max, range_v_step, wrap_v,
-    a_eq, b_eq, c_eq, f_eq, g_eq, h_eq, n, close_v):
+    a_eq, b_eq, c_eq, f_eq, g_eq, h_eq, n, close_v, params=None):
     """ Generate parametrized XYZ surface from built-in Blender extension:
     https://archive.blender.org/wiki/index.php/Extensions:2.6/Py/Scripts/Add_Mesh/Add_3d_Function_Surface/
         Returns pair of vertices and faces
+        params maps extra names used by the equations (e.g. a sponge's radius) to values.
+        surface.xyz_function_surface_verts and surface.surface_topology build the same
+        surface with NumPy, this loop is kept as their reference
     """
 
     verts = []
@@ -95,60 +302,63 @@ def xyz_function_surface_faces(x_eq, y_eq, z_eq,
 
     if wrap_v:
         vRange = vRange - 1
-    
+
+    # the equations' names for this surface, leaving the shared safe_dict alone
+    names = dict(safe_dict, **(params or {}))
+
     try:
         expr_args_x = (
             compile(x_eq, __file__.replace(".py", "_x.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_y = (
             compile(y_eq, __file__.replace(".py", "_y.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_z = (
             compile(z_eq, __file__.replace(".py", "_z.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_a = (
             compile(a_eq, __file__.replace(".py", "_a.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_b = (
             compile(b_eq, __file__.replace(".py", "_b.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_c = (
             compile(c_eq, __file__.replace(".py", "_c.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_f = (
             compile(f_eq, __file__.replace(".py", "_f.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_g = (
             compile(g_eq, __file__.replace(".py", "_g.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
         expr_args_h = (
             compile(h_eq, __file__.replace(".py", "_h.py"), 'eval'),
             {"__builtins__": None},
-            safe_dict)
+            names)
     except:
         import traceback
         print("Error parsing expression: "
             + traceback.format_exc(limit=1))
         return [], []
-    
+
     for vN in range(vRange):
         v = range_v_min + (vN * vStep)
 
         for uN in range(uRange):
             u = range_u_min + (uN * uStep)
 
-            safe_dict['u'] = u
-            safe_dict['v'] = v
+            names['u'] = u
+            names['v'] = v
 
-            safe_dict['n'] = n
+            names['n'] = n
 
             # Try to evaluate the equations.
             try:
@@ -156,17 +366,17 @@ def xyz_function_surface_faces(x_eq, y_eq, z_eq,
                 b = float(eval(*expr_args_b))
                 c = float(eval(*expr_args_c))
 
-                safe_dict['a'] = a
-                safe_dict['b'] = b
-                safe_dict['c'] = c
+                names['a'] = a
+                names['b'] = b
+                names['c'] = c
 
                 f = float(eval(*expr_args_f))
                 g = float(eval(*expr_args_g))
                 h = float(eval(*expr_args_h))
 
-                safe_dict['f'] = f
-                safe_dict['g'] = g
-                safe_dict['h'] = h
+                names['f'] = f
+                names['g'] = g
+                names['h'] = h
 
                 verts.append((
                     float(eval(*expr_args_x)),
@@ -0,0 +1,248 @@
+import numpy as np
+import hashlib
+import os
+import tempfile
+from functools import lru_cache
+
+# Ken Perlin's improved noise permutation, from a fixed seed so every run
+# (and every process) sees the same noise field. Doubled to avoid wrapping.
+_permutation = np.random.RandomState(479).permutation(256)
+PERM = np.concatenate([_permutation, _permutation]).astype(np.intp)
+
+# Gradient directions of improved Perlin noise: the 12 cube edges, padded to 16
+GRADIENTS = np.array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1),
+    (1, 1, 0), (-1, 1, 0), (0, -1, 1), (0, -1, -1)
+], dtype=float)
+# Gradient components looked up directly by corner hash, saving one gather per corner
+GRAD_X = GRADIENTS[PERM & 15, 0].copy()
+GRAD_Y = GRADIENTS[PERM & 15, 1].copy()
+GRAD_Z = GRADIENTS[PERM & 15, 2].copy()
+
+# Points are processed in chunks of this many rows so temporaries stay in cache
+NOISE_CHUNK = 16384
+
+# Baked turbulence lattices are memory-mapped from here and shared between runs
+LATTICE_DIR = os.path.join(tempfile.gettempdir(), 'sea_sponge_cache', 'lattice')
+# Bump this when the noise or the lattice layout changes to invalidate old files
+LATTICE_VERSION = 1
+# Number of lattices kept open at once
+LATTICE_CACHE_SIZE = 4
+
+# Offsets of the three independent samples behind a noise vector,
+# as in Blender's noise_vector
+VECTOR_OFFSETS = np.array([
+    (9.321, -1.531, -7.951),
+    (-4.653, 9.453, 3.792),
+    (5.783, -2.348, 9.173)
+])
+
+
+def fade(t):
+    """ Quintic smoothstep 6t^5 - 15t^4 + 10t^3 """
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def lerp(t, a, b):
+    return a + t * (b - a)
+
+
+def grad_dot(index, x, y, z):
+    """ Dot product of the gradient at PERM[index] with the offset (x, y, z) """
+    return GRAD_X[index] * x + GRAD_Y[index] * y + GRAD_Z[index] * z
+
+
+def fade_derivative(t):
+    """ Derivative of fade, 30t^2(t-1)^2 """
+    return 30 * t * t * (t - 1) * (t - 1)
+
+
+def trilerp(u, v, w, c000, c100, c010, c110, c001, c101, c011, c111):
+    return lerp(w,
+        lerp(v, lerp(u, c000, c100), lerp(u, c010, c110)),
+        lerp(v, lerp(u, c001, c101), lerp(u, c011, c111)))
+
+
+def perlin_chunk(points, with_gradient=False):
+    """ Noise for one chunk of perlin_noise, optionally with its analytic gradient """
+    cell = np.floor(points)
+    frac = points - cell
+    i = cell.astype(np.intp) & 255
+    x, y, z = i[:, 0], i[:, 1], i[:, 2]
+    fx, fy, fz = frac[:, 0], frac[:, 1], frac[:, 2]
+    fx1, fy1, fz1 = fx - 1, fy - 1, fz - 1
+
+    # hash the eight lattice corners around each point
+    a = PERM[x] + y
+    aa = PERM[a] + z
+    ab = PERM[a + 1] + z
+    b = PERM[x + 1] + y
+    ba = PERM[b] + z
+    bb = PERM[b + 1] + z
+    corners = (aa, ba, ab, bb, aa + 1, ba + 1, ab + 1, bb + 1)
+
+    n000 = grad_dot(aa, fx, fy, fz)
+    n100 = grad_dot(ba, fx1, fy, fz)
+    n010 = grad_dot(ab, fx, fy1, fz)
+    n110 = grad_dot(bb, fx1, fy1, fz)
+    n001 = grad_dot(aa + 1, fx, fy, fz1)
+    n101 = grad_dot(ba + 1, fx1, fy, fz1)
+    n011 = grad_dot(ab + 1, fx, fy1, fz1)
+    n111 = grad_dot(bb + 1, fx1, fy1, fz1)
+
+    u, v, w = fade(fx), fade(fy), fade(fz)
+    value = trilerp(u, v, w, n000, n100, n010, n110, n001, n101, n011, n111)
+    if not with_gradient:
+        return value
+
+    # d/dp of the blend weights, applied to the corner values
+    k1 = n100 - n000
+    k2 = n010 - n000
+    k3 = n001 - n000
+    k4 = n000 - n100 - n010 + n110
+    k5 = n000 - n010 - n001 + n011
+    k6 = n000 - n100 - n001 + n101
+    k7 = -n000 + n100 + n010 - n110 + n001 - n101 - n011 + n111
+    gradient = np.empty((len(points), 3))
+    gradient[:, 0] = fade_derivative(fx) * (k1 + k4 * v + k6 * w + k7 * v * w)
+    gradient[:, 1] = fade_derivative(fy) * (k2 + k5 * w + k4 * u + k7 * w * u)
+    gradient[:, 2] = fade_derivative(fz) * (k3 + k6 * u + k5 * v + k7 * u * v)
+    # plus the blend of the corner gradients themselves
+    for axis, table in enumerate((GRAD_X, GRAD_Y, GRAD_Z)):
+        gradient[:, axis] += trilerp(u, v, w, *(table[corner] for corner in corners))
+    return value, gradient
+
+
+def perlin_noise(points):
+    """ Improved Perlin gradient noise at each row of an (N,3) array, roughly in [-1, 1] """
+    points = np.asarray(points, dtype=float)
+    value = np.empty(len(points))
+    for start in range(0, len(points), NOISE_CHUNK):
+        value[start:start + NOISE_CHUNK] = perlin_chunk(points[start:start + NOISE_CHUNK])
+    return value
+
+
+def perlin_noise_gradient(points):
+    """ perlin_noise together with its analytic gradient (N,3), in a single pass """
+    points = np.asarray(points, dtype=float)
+    value = np.empty(len(points))
+    gradient = np.empty((len(points), 3))
+    for start in range(0, len(points), NOISE_CHUNK):
+        chunk = slice(start, start + NOISE_CHUNK)
+        value[chunk], gradient[chunk] = perlin_chunk(points[chunk], with_gradient=True)
+    return value, gradient
+
+
+def noise_vector(points):
+    """ Vectorized counterpart of mathutils.noise.noise_vector for an (N,3) array """
+    points = np.asarray(points, dtype=float)
+    # all three components in a single noise call
+    shifted = (points[None, :, :] + VECTOR_OFFSETS[:, None, :]).reshape(-1, 3)
+    return perlin_noise(shifted).reshape(3, -1).T
+
+
+def turbulence_vector(points, octaves, hard, amplitude_scale=0.5, frequency_scale=2.0):
+    """ Vectorized counterpart of mathutils.noise.turbulence_vector for an (N,3) array.
+        Like Blender, the first octave is always sampled and octaves counts it
+    """
+    points = np.asarray(points, dtype=float)
+    turbulence = noise_vector(points)
+    if hard:
+        turbulence = np.abs(turbulence)
+    amplitude = 1.0
+    frequency = 1.0
+    for octave in range(1, octaves):
+        amplitude *= amplitude_scale
+        frequency *= frequency_scale
+        octave_noise = noise_vector(points * frequency)
+        if hard:
+            octave_noise = np.abs(octave_noise)
+        turbulence += amplitude * octave_noise
+    return turbulence
+
+
+def noise_vector_gradient(points):
+    """ noise_vector together with its Jacobian (N,3,3), where [:, i, j] is d component i / d axis j """
+    points = np.asarray(points, dtype=float)
+    shifted = (points[None, :, :] + VECTOR_OFFSETS[:, None, :]).reshape(-1, 3)
+    value, gradient = perlin_noise_gradient(shifted)
+    return value.reshape(3, -1).T, gradient.reshape(3, -1, 3).transpose(1, 0, 2)
+
+
+def turbulence_vector_gradient(points, octaves, hard, amplitude_scale=0.5, frequency_scale=2.0):
+    """ turbulence_vector together with its analytic Jacobian (N,3,3), in one pass over the octaves.
+        Unlike a finite difference this needs no extra samples and no step size
+    """
+    points = np.asarray(points, dtype=float)
+    turbulence = np.zeros((len(points), 3))
+    jacobian = np.zeros((len(points), 3, 3))
+    amplitude = 1.0
+    frequency = 1.0
+    for octave in range(max(octaves, 1)):
+        if octave:
+            amplitude *= amplitude_scale
+            frequency *= frequency_scale
+        octave_noise, octave_jacobian = noise_vector_gradient(points * frequency)
+        if hard:
+            octave_jacobian *= np.sign(octave_noise)[:, :, None]
+            octave_noise = np.abs(octave_noise)
+        turbulence += amplitude * octave_noise
+        # chain rule for the frequency scaling of the sample position
+        jacobian += (amplitude * frequency) * octave_jacobian
+    return turbulence, jacobian
+
+
+@lru_cache(maxsize=LATTICE_CACHE_SIZE)
+def turbulence_lattice(octaves, hard, amplitude_scale, frequency_scale, resolution, bounds):
+    """ Turbulence baked once on a resolution^3 grid spanning bounds ((x0, y0, z0), (x1, y1, z1)).
+        The grid is saved under LATTICE_DIR keyed on its parameters and memory-mapped back,
+        so later sponges and later runs only pay for lookups.
+        Channels are the turbulence vector followed by its d/dx of x and d/dy of y (for STUCCO)
+    """
+    key = repr((LATTICE_VERSION, octaves, hard, amplitude_scale, frequency_scale, resolution, bounds))
+    path = os.path.join(LATTICE_DIR, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+
+    os.makedirs(LATTICE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    lattice = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+        shape=(resolution, resolution, resolution, 5))
+    axes = [np.linspace(bounds[0][axis], bounds[1][axis], resolution) for axis in range(3)]
+    yz = np.stack(np.meshgrid(axes[1], axes[2], indexing='ij'), axis=-1).reshape(-1, 2)
+    # bake one x slab at a time to keep memory bounded
+    for index, x in enumerate(axes[0]):
+        points = np.column_stack([np.full(len(yz), x), yz])
+        turbulence, jacobian = turbulence_vector_gradient(points, octaves, hard,
+            amplitude_scale=amplitude_scale, frequency_scale=frequency_scale)
+        lattice[index] = np.column_stack([turbulence, jacobian[:, 0, 0], jacobian[:, 1, 1]]).reshape(
+            resolution, resolution, 5)
+    lattice.flush()
+    del lattice
+    # publish atomically so a concurrent reader never sees a half-written lattice
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+def sample_lattice(lattice, bounds, points):
+    """ Trilinearly interpolate every channel of a lattice at an (N,3) array of points.
+        Points outside bounds are clamped to the boundary
+    """
+    resolution = np.array(lattice.shape[:3])
+    low = np.array(bounds[0], dtype=float)
+    high = np.array(bounds[1], dtype=float)
+    grid = (np.asarray(points, dtype=float) - low) / (high - low) * (resolution - 1)
+    grid = np.clip(grid, 0, resolution - 1)
+    cell = np.minimum(np.floor(grid).astype(np.intp), resolution - 2)
+    t = grid - cell
+    x0, y0, z0 = cell[:, 0], cell[:, 1], cell[:, 2]
+    tx, ty, tz = t[:, 0, None], t[:, 1, None], t[:, 2, None]
+
+    def corner(dx, dy, dz):
+        return lattice[x0 + dx, y0 + dy, z0 + dz]
+
+    return trilerp(tx, ty, tz,
+        corner(0, 0, 0), corner(1, 0, 0), corner(0, 1, 0), corner(1, 1, 0),
+        corner(0, 0, 1), corner(1, 0, 1), corner(0, 1, 1), corner(1, 1, 1))